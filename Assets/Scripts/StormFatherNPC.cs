@@ -8,6 +8,7 @@ using System.Text;
 using Newtonsoft.Json;
 using System.Linq;
 using System.Collections;
+using System.IO;
 
 public class StormFatherNPC : MonoBehaviour
 {
@@ -19,6 +20,9 @@ public class StormFatherNPC : MonoBehaviour
     [SerializeField] private Button submitQuestionButton;
     [SerializeField] private Button closeDialogueButton;
     public string apiEndpoint = "http://localhost:8000/ask";
+    // Streams the answer word by word instead of waiting for the whole reply
+    public bool useStreaming = true;
+    public string streamEndpoint = "http://localhost:8000/ask_stream?format=ndjson";
 
     [TextArea(3, 10)]
     public List<string> dialoguePages = new List<string>
@@ -238,6 +242,12 @@ public class StormFatherNPC : MonoBehaviour
                 "application/json"
             );
 
+            if (useStreaming)
+            {
+                await StreamAnswer(content);
+                return;
+            }
+
             var response = await httpClient.PostAsync(apiEndpoint, content);
             if (response.IsSuccessStatusCode)
             {
@@ -264,6 +274,56 @@ public class StormFatherNPC : MonoBehaviour
         }
     }
 
+    private async Task StreamAnswer(HttpContent content)
+    {
+        var request = new HttpRequestMessage(HttpMethod.Post, streamEndpoint) { Content = content };
+        // ResponseHeadersRead hands us the body as it arrives instead of buffering all of it
+        using (var response = await httpClient.SendAsync(request, HttpCompletionOption.ResponseHeadersRead))
+        {
+            if (!response.IsSuccessStatusCode)
+                throw new HttpRequestException($"API request failed: {response.StatusCode}");
+
+            using (var stream = await response.Content.ReadAsStreamAsync())
+            using (var reader = new StreamReader(stream))
+            {
+                var answer = new StringBuilder();
+                string line;
+                while ((line = await reader.ReadLineAsync()) != null)
+                {
+                    if (string.IsNullOrWhiteSpace(line))
+                        continue;
+                    var evt = JsonConvert.DeserializeObject<StreamEvent>(line);
+                    if (evt.type == "token")
+                    {
+                        answer.Append(evt.text);
+                        if (dialogueText != null)
+                            dialogueText.text = answer.ToString();
+                    }
+                    else if (evt.type == "error")
+                    {
+                        throw new HttpRequestException(evt.detail);
+                    }
+                    else if (evt.type == "done")
+                    {
+                        break;
+                    }
+                }
+
+                questionsAsked++;
+                if (dialogueText != null)
+                    dialogueText.text = answer.ToString().Trim() + "\n\n<Press E to continue...>";
+                waitingForContinue = true;
+            }
+        }
+    }
+
+    private class StreamEvent
+    {
+        public string type { get; set; }
+        public string text { get; set; }
+        public string detail { get; set; }
+    }
+
     private class AskResponse
     {
         public string answer { get; set; }
@@ -0,0 +1,265 @@
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+def normalize_question(question: str) -> str:
+    """Case, punctuation and whitespace insensitive form of a question"""
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+
+def context_key(context: str) -> str:
+    return hashlib.sha1(context.encode("utf-8")).hexdigest()
+
+
+class CacheEntry:
+    __slots__ = ("question", "answer", "context", "context_key", "embedding", "kb_version", "created", "size")
+
+    def __init__(self, question, answer, context, embedding, kb_version, created=None):
+        self.question = question
+        self.answer = answer
+        self.context = context
+        self.context_key = context_key(context)
+        self.embedding = embedding
+        self.kb_version = kb_version
+        self.created = created if created is not None else time.time()
+        # Rough memory footprint: strings, embedding and per-entry overhead
+        self.size = len(question) + len(answer) + len(context) + 300
+        if embedding is not None:
+            self.size += embedding.nbytes
+
+
+class AnswerCache:
+    """LRU/TTL cache of LLM answers, looked up by exact question or by query embedding.
+
+    Exact hits are only served while the knowledge base is unchanged (kb_version),
+    since the question alone says nothing about the context the answer was built
+    from. Semantic hits need a similar enough query embedding *and* the same
+    retrieved context, so they stay correct as documents are added.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 24 * 3600,
+        semantic_threshold: float = 0.92,
+        path: Optional[str] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self.path = path
+        self.entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.bytes = 0
+        # Normalized embeddings for semantic lookup, one row per entry; rows of removed
+        # entries are zeroed and reused, so puts and evictions touch a single row
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self._free_rows: List[int] = []
+
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self._llm_latency = None
+
+    @classmethod
+    def from_env(cls) -> Optional["AnswerCache"]:
+        """Build a cache from ANSWER_CACHE_* environment variables, or None if disabled"""
+        if os.getenv("ANSWER_CACHE_ENABLED", "1") == "0":
+            return None
+        cache = cls(
+            max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000")),
+            max_bytes=int(float(os.getenv("ANSWER_CACHE_MAX_MB", "64")) * 1024 * 1024),
+            ttl=float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600))),
+            semantic_threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92")),
+            path=os.getenv("ANSWER_CACHE_PATH"),
+        )
+        if cache.path:
+            cache.load()
+        return cache
+
+    # ---- lookups -------------------------------------------------------
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return self.ttl > 0 and time.time() - entry.created > self.ttl
+
+    def get_exact(self, question: str, kb_version=None) -> Optional[CacheEntry]:
+        key = normalize_question(question)
+        entry = self.entries.get(key)
+        if entry is None or entry.kb_version != kb_version:
+            return None
+        if self._expired(entry):
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        self._hit("exact")
+        return entry
+
+    def get_semantic(self, embedding, context: str) -> Optional[CacheEntry]:
+        if embedding is None or not self.entries:
+            return None
+        matrix = self._matrix
+        if matrix is None or not self._rows:
+            return None
+        query = np.asarray(embedding, dtype="float32")
+        if query.shape != matrix.shape[1:]:
+            return None
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = matrix @ query
+        ckey = context_key(context)
+        for pos in np.argsort(-scores):
+            if scores[pos] < self.semantic_threshold:
+                break
+            key = self._matrix_keys[pos]
+            entry = self.entries.get(key) if key is not None else None
+            if entry is None or entry.context_key != ckey:
+                continue
+            if self._expired(entry):
+                self._remove(key)
+                continue
+            self.entries.move_to_end(key)
+            self._hit("semantic")
+            return entry
+        return None
+
+    def miss(self):
+        self.misses += 1
+
+    def _hit(self, kind: str):
+        if kind == "exact":
+            self.hits_exact += 1
+        else:
+            self.hits_semantic += 1
+        if self._llm_latency is not None:
+            self.latency_saved += self._llm_latency
+
+    def record_llm_latency(self, seconds: float):
+        """Feed the running estimate of what a hit saves"""
+        if self._llm_latency is None:
+            self._llm_latency = seconds
+        else:
+            self._llm_latency = 0.9 * self._llm_latency + 0.1 * seconds
+
+    def _add_row(self, key: str, embedding: np.ndarray):
+        if self._matrix is None:
+            self._matrix = np.zeros((min(self.max_entries + 1, 1024), embedding.shape[0]), dtype="float32")
+            self._matrix_keys = [None] * len(self._matrix)
+            self._free_rows = list(range(len(self._matrix) - 1, -1, -1))
+        elif embedding.shape != self._matrix.shape[1:]:
+            # Different embedding model than the cached entries: exact lookups only
+            return
+        if not self._free_rows:
+            # put() adds before evicting, so at most max_entries + 1 rows are ever in use
+            old = len(self._matrix)
+            grown = np.zeros((min(2 * old, self.max_entries + 1), self._matrix.shape[1]), dtype="float32")
+            grown[:old] = self._matrix
+            self._matrix = grown
+            self._matrix_keys += [None] * (len(grown) - old)
+            self._free_rows = list(range(len(grown) - 1, old - 1, -1))
+        row = self._free_rows.pop()
+        self._matrix[row] = embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+        self._matrix_keys[row] = key
+        self._rows[key] = row
+
+    def _clear_row(self, key: str):
+        row = self._rows.pop(key, None)
+        if row is not None:
+            self._matrix[row] = 0
+            self._matrix_keys[row] = None
+            self._free_rows.append(row)
+
+    # ---- updates -------------------------------------------------------
+
+    def put(self, question: str, answer: str, context: str = "", embedding=None, kb_version=None):
+        key = normalize_question(question)
+        if not key:
+            return
+        if key in self.entries:
+            self._remove(key)
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype="float32")
+        entry = CacheEntry(key, answer, context, embedding, kb_version)
+        self.entries[key] = entry
+        self.bytes += entry.size
+        if embedding is not None:
+            self._add_row(key, embedding)
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key)
+        self.bytes -= entry.size
+        self._clear_row(key)
+
+    def clear(self):
+        """Drop every entry, e.g. after the knowledge base changed"""
+        self.entries.clear()
+        self.bytes = 0
+        self._matrix = None
+        self._matrix_keys = []
+        self._rows = {}
+        self._free_rows = []
+
+    def stats(self) -> Dict:
+        lookups = self.hits_exact + self.hits_semantic + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits_exact": self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "misses": self.misses,
+            "hit_rate": (self.hits_exact + self.hits_semantic) / lookups if lookups else 0.0,
+            "latency_saved_s": round(self.latency_saved, 3),
+        }
+
+    # ---- persistence ---------------------------------------------------
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for e in self.entries.values():
+                f.write(json.dumps({
+                    "question": e.question,
+                    "answer": e.answer,
+                    "context": e.context,
+                    "embedding": e.embedding.tolist() if e.embedding is not None else None,
+                    "kb_version": e.kb_version,
+                    "created": e.created,
+                }) + "\n")
+        os.replace(tmp, self.path)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                embedding = np.asarray(row["embedding"], dtype="float32") if row["embedding"] is not None else None
+                entry = CacheEntry(row["question"], row["answer"], row["context"], embedding,
+                                   row["kb_version"], created=row["created"])
+                if self._expired(entry):
+                    continue
+                if entry.question in self.entries:
+                    self._remove(entry.question)
+                self.entries[entry.question] = entry
+                self.bytes += entry.size
+                if embedding is not None:
+                    self._add_row(entry.question, embedding)
+                # Trim as we go, which also keeps the matrix within max_entries + 1 rows
+                while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                    self._remove(next(iter(self.entries)))
@@ -1,7 +1,11 @@
 import os
+import time
 import openai
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
+from llm_client import LLMClient
+from answer_cache import AnswerCache
+from streaming import stream_events
 
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
@@ -9,6 +13,15 @@ if not openai.api_key:
     raise RuntimeError("Missing OPENAI_API_KEY environment variable")
 
 app = FastAPI(title="Father Storm Q&A API")
+llm = LLMClient.from_env()
+# No retrieval here, so only exact (normalized question) matches are cached
+answer_cache = AnswerCache.from_env()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await llm.close()
+    if answer_cache is not None:
+        answer_cache.save()
 
 class AskRequest(BaseModel):
     question: str  
@@ -16,14 +29,8 @@ class AskRequest(BaseModel):
 class AskResponse(BaseModel):
     answer: str  
 
-@app.post("/ask", response_model=AskResponse)
-async def ask(request: AskRequest):
-    q = request.question.strip()
-    if not q:
-        raise HTTPException(status_code=400, detail="question cannot be empty")
-
-    
-    messages = [
+def build_messages(q: str):
+    return [
         {
             "role": "system",
             "content": (
@@ -39,14 +46,23 @@ async def ask(request: AskRequest):
         {"role": "user", "content": q}
     ]
 
+@app.post("/ask", response_model=AskResponse)
+async def ask(request: AskRequest):
+    q = request.question.strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="question cannot be empty")
+
+    if answer_cache is not None:
+        cached = answer_cache.get_exact(q)
+        if cached is not None:
+            return AskResponse(answer=cached.answer)
+        answer_cache.miss()
+
+    messages = build_messages(q)
+
     try:
-        
-        resp = openai.chat.completions.create(
-            model="gpt-4",  
-            messages=messages,
-            temperature=0.5,
-            max_tokens=256,
-        )
+        started = time.perf_counter()
+        resp = await llm.chat(messages, temperature=0.5, max_tokens=256)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OpenAI API error: {e}")
 
@@ -56,4 +72,47 @@ async def ask(request: AskRequest):
     except (KeyError, IndexError):
         raise HTTPException(status_code=500, detail="Unexpected response format from OpenAI")
 
+    if answer_cache is not None:
+        answer_cache.record_llm_latency(time.perf_counter() - started)
+        answer_cache.put(q, answer_text)
+
     return AskResponse(answer=answer_text)
+
+@app.post("/ask_stream")
+async def ask_stream(request: AskRequest, format: str = "sse"):
+    """Like /ask, but streams token events followed by a done event"""
+    q = request.question.strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="question cannot be empty")
+
+    async def events():
+        if answer_cache is not None:
+            cached = answer_cache.get_exact(q)
+            if cached is not None:
+                yield {"type": "token", "text": cached.answer}
+                yield {"type": "done", "answer": cached.answer}
+                return
+            answer_cache.miss()
+
+        parts = []
+        try:
+            started = time.perf_counter()
+            async for text in llm.stream_chat(build_messages(q), temperature=0.5, max_tokens=256):
+                parts.append(text)
+                yield {"type": "token", "text": text}
+        except Exception as e:
+            # Headers are already sent, so the error has to travel in-band
+            yield {"type": "error", "detail": f"OpenAI API error: {e}"}
+            return
+
+        answer_text = "".join(parts).strip()
+        if answer_cache is not None:
+            answer_cache.record_llm_latency(time.perf_counter() - started)
+            answer_cache.put(q, answer_text)
+        yield {"type": "done", "answer": answer_text}
+
+    return stream_events(events(), format)
+
+@app.get("/stats")
+async def stats():
+    return {"answer_cache": answer_cache.stats() if answer_cache else None}
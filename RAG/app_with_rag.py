@@ -1,22 +1,100 @@
 import os
+import json
+import codecs
+import asyncio
+import time
 import openai
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from pydantic import BaseModel, Field
 from rag_engine import RAGEngine
+from segment_store import ReadOnlyStore
+from rerank import CrossEncoderReranker
+from llm_client import LLMClient
+from answer_cache import AnswerCache
+from streaming import stream_events
+from ingest import FORMATS, IngestJob, IngestPipeline, RecordSplitter, check_chunking
+from startup import Startup
+from metrics import CONTENT_TYPE, EngineCollector, MetricsMiddleware, current_trace, observe, register, render, span
+from errors import APIError, api_error_handler, error_event, llm_error, unhandled_error_handler
+from profiler import SamplingProfiler
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 if not openai.api_key:
     raise RuntimeError("Missing OPENAI_API_KEY environment variable")
 
-app = FastAPI(title="Father Storm Q&A API with RAG")
+llm = LLMClient.from_env()
+answer_cache = AnswerCache.from_env()
 
-
-rag = RAGEngine()
+# Constructing the engine is cheap; the model and index are loaded by `startup`
+rag = RAGEngine(
+    search_workers=int(os.getenv("RAG_SEARCH_WORKERS", "4")),
+    max_batch=int(os.getenv("RAG_MAX_BATCH", "32")),
+    batch_window_ms=float(os.getenv("RAG_BATCH_WINDOW_MS", "5")),
+    batch_workers=int(os.getenv("RAG_BATCH_WORKERS", "1")),
+    index_type=os.getenv("RAG_INDEX_TYPE", "flat_ip"),
+    index_params=json.loads(os.getenv("RAG_INDEX_PARAMS", "{}")),
+    snapshot_min_docs=int(os.getenv("RAG_SNAPSHOT_MIN_DOCS", "10000")),
+    snapshot_max_tail=float(os.getenv("RAG_SNAPSHOT_MAX_TAIL", "0.25")),
+    onnx_model_path=os.getenv("RAG_ONNX_MODEL_PATH") or None,
+    hybrid=os.getenv("RAG_HYBRID", "1") == "1",
+    fusion_candidates=int(os.getenv("RAG_FUSION_CANDIDATES", "20")),
+    rrf_k=int(os.getenv("RAG_RRF_K", "60")),
+    reranker=CrossEncoderReranker.from_env(),
+)
 RAG_DATA_PATH = os.getenv("RAG_DATA_PATH", "rag_data")
-try:
-    rag.load(RAG_DATA_PATH)
-except Exception:
-    pass
+startup = Startup(rag, RAG_DATA_PATH, warmup=os.getenv("RAG_WARMUP", "1") == "1")
+
+# Under gunicorn --preload (see gunicorn_conf.py) the master loads model and index
+# once at import and every forked worker shares those pages copy-on-write
+if os.getenv("RAG_PRELOAD", "0") == "1":
+    startup.preload()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load in the background so liveness probes are answered while the model loads
+    startup.start()
+    yield
+    await llm.close()
+    rag.close()
+    if answer_cache is not None:
+        answer_cache.save()
+
+app = FastAPI(title="Father Storm Q&A API with RAG", lifespan=lifespan)
+
+# Request latency/in-flight metrics, X-Request-ID, and Server-Timing for X-Trace: 1 requests
+app.add_middleware(MetricsMiddleware, trace_all=os.getenv("RAG_TRACE_ALL", "0") == "1")
+app.add_exception_handler(APIError, api_error_handler)
+app.add_exception_handler(Exception, unhandled_error_handler)
+register(EngineCollector(rag, answer_cache, startup))
+
+def require_ready():
+    if not startup.ready:
+        raise APIError(503, "not_ready", f"RAG engine not ready ({startup.state})", "startup", retry_after=1)
+
+async def require_writable():
+    # The segment store has one writer process (see segment_store.py). With several workers
+    # the first one to write becomes it; the others, and a server started while ingest.py
+    # runs, are read-only
+    try:
+        await rag.aacquire_writer(RAG_DATA_PATH)
+    except ReadOnlyStore as e:
+        raise APIError(
+            409, "read_only", f"{e}; with several workers, add documents with ingest.py while the server is stopped",
+            "write",
+        ) from e
+
+@app.get("/health/live")
+async def health_live():
+    """The process is up and serving; says nothing about the model"""
+    return {"status": "alive", "state": startup.state}
+
+@app.get("/health/ready")
+async def health_ready():
+    """200 once the model and index are loaded and warmed up, 503 before that or after a failed load"""
+    return JSONResponse(startup.info(), status_code=200 if startup.ready else 503)
 
 class AskRequest(BaseModel):
     question: str  
@@ -25,16 +103,33 @@ class AskResponse(BaseModel):
     answer: str  
     context: str  
 
-@app.post("/ask_rag", response_model=AskResponse)
-async def ask_rag(request: AskRequest):
-    q = request.question.strip()
-    if not q:
-        raise HTTPException(status_code=400, detail="question cannot be empty")
+async def retrieve(q: str):
+    """Context for a question, plus a cached answer if there is one"""
+    # Repeated question and nothing new in the knowledge base: skip retrieval and the LLM
+    if answer_cache is not None:
+        with span("cache_exact"):
+            cached = answer_cache.get_exact(q, kb_version=rag.num_documents)
+        if cached is not None:
+            return cached.context, None, cached.answer
 
     # Retrieve context from RAG
-    context_docs = rag.search(q, k=3)
+    try:
+        with span("retrieve"):
+            context_docs, query_embedding = await rag.asearch_with_embedding(q, k=3)
+    except Exception as e:
+        raise APIError(500, "retrieval_failed", f"Searching the knowledge base failed ({type(e).__name__})", "retrieve") from e
     context = "\n".join(context_docs)
 
+    # A similar enough question that retrieved the same context
+    if answer_cache is not None:
+        with span("cache_semantic"):
+            cached = answer_cache.get_semantic(query_embedding, context)
+        if cached is not None:
+            return context, query_embedding, cached.answer
+        answer_cache.miss()
+    return context, query_embedding, None
+
+def build_messages(q: str, context: str):
     # Augment the system prompt with retrieved context
     system_prompt = (
         f"Context from Roshar's history (may be relevant):\n{context}\n"
@@ -46,30 +141,220 @@ async def ask_rag(request: AskRequest):
         "Keep the answers below 301 letters (including spaces)."
     )
 
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": q}
     ]
 
+def remember(q: str, answer_text: str, context: str, query_embedding, started: float):
+    if answer_cache is not None:
+        answer_cache.record_llm_latency(time.perf_counter() - started)
+        with span("cache_store"):
+            answer_cache.put(q, answer_text, context, embedding=query_embedding, kb_version=rag.num_documents)
+
+@app.post("/ask_rag", response_model=AskResponse, dependencies=[Depends(require_ready)])
+async def ask_rag(request: AskRequest):
+    q = request.question.strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="question cannot be empty")
+
+    context, query_embedding, cached_answer = await retrieve(q)
+    if cached_answer is not None:
+        return AskResponse(answer=cached_answer, context=context)
+
+    with span("prompt"):
+        messages = build_messages(q, context)
+
     try:
-        resp = openai.chat.completions.create(
-            model="gpt-4",
-            messages=messages,
-            temperature=0.5,
-            max_tokens=256,
-        )
+        started = time.perf_counter()
+        with span("llm"):
+            resp = await llm.chat(messages, temperature=0.5, max_tokens=256)
         answer_text = resp.choices[0].message.content.strip()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"OpenAI API error: {e}")
+        raise llm_error(e) from e
 
+    remember(q, answer_text, context, query_embedding, started)
     return AskResponse(answer=answer_text, context=context)
 
+@app.post("/ask_rag_stream", dependencies=[Depends(require_ready)])
+async def ask_rag_stream(request: AskRequest, format: str = "sse"):
+    """Like /ask_rag, but streams a context event, then token events, then done"""
+    q = request.question.strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="question cannot be empty")
+
+    async def events():
+        try:
+            context, query_embedding, cached_answer = await retrieve(q)
+        except APIError as e:
+            yield error_event(e)
+            return
+        yield {"type": "context", "context": context}
+        if cached_answer is not None:
+            yield {"type": "token", "text": cached_answer}
+            yield {"type": "done", "answer": cached_answer}
+            return
+
+        parts = []
+        try:
+            with span("prompt"):
+                messages = build_messages(q, context)
+            started = time.perf_counter()
+            with span("llm"):
+                async for text in llm.stream_chat(messages, temperature=0.5, max_tokens=256):
+                    if not parts:
+                        observe("llm_first_token", time.perf_counter() - started)
+                    parts.append(text)
+                    yield {"type": "token", "text": text}
+        except Exception as e:
+            # Headers are already sent, so the error has to travel in-band
+            yield error_event(llm_error(e))
+            return
+
+        answer_text = "".join(parts).strip()
+        remember(q, answer_text, context, query_embedding, started)
+        done = {"type": "done", "answer": answer_text}
+        # Server-Timing went out with the headers, so traced streams get their timings here
+        trace = current_trace()
+        if trace is not None:
+            done["timings_ms"] = trace.totals_ms()
+        yield done
+
+    return stream_events(events(), format)
+
 # Utility endpoint to add documents to the RAG knowledge base
 class AddDocsRequest(BaseModel):
     documents: list[str]
 
-@app.post("/add_docs")
+@app.post("/add_docs", dependencies=[Depends(require_ready), Depends(require_writable)])
 async def add_docs(request: AddDocsRequest):
-    rag.add_documents(request.documents)
-    rag.save(RAG_DATA_PATH)
-    return {"status": "success", "added": len(request.documents)} 
\ No newline at end of file
+    await rag.aadd_documents(request.documents)
+    await rag.asave(RAG_DATA_PATH)
+    # Cached answers may have been built from context that is no longer the best match
+    if answer_cache is not None:
+        answer_cache.clear()
+    return {"status": "success", "added": len(request.documents)}
+
+@app.get("/stats")
+async def stats():
+    return {
+        "startup": startup.info(),
+        "batcher": rag.batcher.stats() if rag.batcher else None,
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "index": rag.index.info(),
+        "search": rag.search_info(),
+        "store": {
+            "documents": rag.num_documents,
+            "pending": len(rag.pending_documents),
+            "segments": len(rag.store.segments) if rag.store else 0,
+        },
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(render(), media_type=CONTENT_TYPE)
+
+# Sampling profiler, switched on and off at runtime; only exposed with RAG_PROFILER_ENABLED=1
+profiler = SamplingProfiler()
+
+def require_profiler():
+    if os.getenv("RAG_PROFILER_ENABLED", "0") != "1":
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.post("/debug/profiler/start", dependencies=[Depends(require_profiler)])
+async def profiler_start(interval_ms: float = 10.0, duration_s: Optional[float] = None, include_idle: bool = False):
+    profiler.start(interval_ms=interval_ms, duration_s=duration_s, include_idle=include_idle)
+    return profiler.info()
+
+@app.post("/debug/profiler/stop", dependencies=[Depends(require_profiler)])
+async def profiler_stop():
+    # Joining the sampler thread can take one interval; keep it off the event loop
+    await asyncio.get_running_loop().run_in_executor(None, profiler.stop)
+    return {**profiler.info(), "top": profiler.top(20)}
+
+@app.get("/debug/profiler", dependencies=[Depends(require_profiler)])
+async def profiler_report(format: str = "json", limit: int = 50):
+    """format=json: top functions; format=folded: folded stacks for flamegraph.pl / speedscope"""
+    if format == "folded":
+        return PlainTextResponse(profiler.folded())
+    return {**profiler.info(), "top": profiler.top(limit)}
+
+class SearchParamsRequest(BaseModel):
+    nprobe: Optional[int] = Field(None, ge=1)
+    ef_search: Optional[int] = Field(None, ge=1)
+    hybrid: Optional[bool] = None
+    fusion_candidates: Optional[int] = Field(None, ge=1)
+    rerank_max_candidates: Optional[int] = Field(None, ge=1)
+    rerank_max_ms: Optional[float] = Field(None, ge=0)
+
+@app.post("/index/search_params")
+async def set_search_params(request: SearchParamsRequest):
+    # Takes the index lock, which an IVF train or a large add can hold for a while
+    await rag.aset_search_params(**request.model_dump())
+    return {"index": rag.index.info(), "search": rag.search_info()}
+
+# Streaming bulk ingestion: the body is parsed as it arrives and encoded on a background thread
+ingest_jobs: dict[str, IngestJob] = {}
+# Finished jobs whose status can still be looked up; older ones are forgotten
+INGEST_JOBS_KEPT = int(os.getenv("RAG_INGEST_JOBS_KEPT", "100"))
+
+def forget_finished_jobs():
+    finished = [job_id for job_id, job in ingest_jobs.items() if job.status != "running"]
+    for job_id in finished[:max(0, len(finished) - INGEST_JOBS_KEPT)]:
+        del ingest_jobs[job_id]
+
+@app.post("/ingest", status_code=202, dependencies=[Depends(require_ready), Depends(require_writable)])
+async def ingest(
+    request: Request,
+    format: str = "jsonl",
+    text_field: str = "text",
+    chunk_size: int = Query(1000, gt=0),
+    overlap: int = Query(200, ge=0),
+):
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {FORMATS}")
+    try:
+        check_chunking(chunk_size, overlap)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    pipeline = IngestPipeline(
+        rag,
+        RAG_DATA_PATH,
+        chunk_size=chunk_size,
+        overlap=overlap,
+        workers=int(os.getenv("RAG_INGEST_WORKERS", "0")),
+    )
+    job = IngestJob(pipeline)
+    forget_finished_jobs()
+    ingest_jobs[job.id] = job
+
+    loop = asyncio.get_running_loop()
+    splitter = RecordSplitter(format, text_field)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    try:
+        async for chunk in request.stream():
+            buffer += decoder.decode(chunk)
+            *lines, buffer = buffer.split("\n")
+            records = [record for line in lines for record in splitter.feed(line)]
+            if records:
+                # job.put blocks while the pipeline is behind; keep that off the event loop
+                await loop.run_in_executor(None, job.put, records)
+        buffer += decoder.decode(b"", final=True)
+        records = splitter.feed(buffer) + splitter.flush()
+        if records:
+            await loop.run_in_executor(None, job.put, records)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse upload: {e}")
+    finally:
+        job.finish()
+    return job.info()
+
+@app.get("/ingest/{job_id}")
+async def ingest_status(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="unknown ingest job")
+    return job.info()
@@ -0,0 +1,106 @@
+"""Recall@k vs latency vs memory for the VectorIndex backends.
+
+Builds a synthetic clustered corpus of normalized 384-d vectors (MiniLM's size),
+computes exact cosine neighbours as ground truth, then sweeps each backend's
+search parameter.
+
+    python bench_index.py                      # 1M vectors, as for a wiki-sized lore dump
+    python bench_index.py --n 100000 --backends flat_ip hnsw ivf_flat
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from index_backends import VectorIndex
+
+SWEEPS = {
+    "flat_ip": [{}],
+    "hnsw": [{"ef_search": ef} for ef in (16, 32, 64, 128, 256)],
+    "ivf_flat": [{"nprobe": n} for n in (1, 4, 16, 64, 128)],
+    "ivf_pq": [{"nprobe": n} for n in (1, 4, 16, 64, 128)],
+    "sq8": [{}],
+}
+
+
+def synthetic_corpus(n, dim, clusters, seed):
+    # Topic clusters with noise, closer to real sentence embeddings than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    data = np.empty((n, dim), dtype=np.float32)
+    step = 100000
+    for start in range(0, n, step):
+        stop = min(n, start + step)
+        labels = rng.integers(0, clusters, stop - start)
+        data[start:stop] = centers[labels] + 0.8 * rng.standard_normal((stop - start, dim), dtype=np.float32)
+    faiss.normalize_L2(data)
+    return data
+
+
+def recall_at_k(found, truth, k):
+    hits = sum(len(set(f[:k]) & set(t[:k])) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def main(args):
+    print(f"Generating {args.n} x {args.dim} corpus...")
+    data = synthetic_corpus(args.n, args.dim, args.clusters, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = data[rng.choice(args.n, args.queries, replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape, dtype=np.float32)
+    faiss.normalize_L2(queries)
+
+    exact = faiss.IndexFlatIP(args.dim)
+    exact.add(data)
+    _, truth = exact.search(queries, args.k)
+    del exact
+
+    print(f"{'backend':<10} {'param':<14} {'build s':>8} {'recall@' + str(args.k):>10} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'batch qps':>10} {'memory MB':>10}")
+    for kind in args.backends:
+        params = {"train_size": args.train_size}
+        if kind == "ivf_pq":
+            params["pq_m"] = args.pq_m
+        vi = VectorIndex(kind, args.dim, **params)
+        start = time.perf_counter()
+        for i in range(0, args.n, 100000):
+            vi.add(data[i:i + 100000])
+        vi.train()
+        build = time.perf_counter() - start
+        memory = vi.memory_bytes() / 1e6
+
+        for sweep in SWEEPS[kind]:
+            vi.set_search_params(**sweep)
+            # Single-query latency, as seen by one /ask_rag call
+            latencies = []
+            found = []
+            for q in queries:
+                t = time.perf_counter()
+                _, idx = vi.search(q[None, :], args.k)
+                latencies.append(time.perf_counter() - t)
+                found.append(idx[0])
+            # Batched throughput, as seen through the query batcher
+            t = time.perf_counter()
+            vi.search(queries, args.k)
+            qps = len(queries) / (time.perf_counter() - t)
+
+            latencies = np.array(latencies) * 1000
+            label = ",".join(f"{k}={v}" for k, v in sweep.items()) or "-"
+            print(f"{kind:<10} {label:<14} {build:>8.1f} {recall_at_k(found, truth, args.k):>10.3f} "
+                  f"{np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 99):>8.2f} "
+                  f"{qps:>10.0f} {memory:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--train-size", type=int, default=100_000)
+    parser.add_argument("--pq-m", type=int, default=48)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backends", nargs="+", default=list(SWEEPS), choices=list(SWEEPS))
+    main(parser.parse_args())
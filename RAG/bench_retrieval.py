@@ -0,0 +1,133 @@
+"""Retrieval quality and latency: vector vs BM25 vs hybrid (RRF) vs hybrid + rerank.
+
+Indexes the labeled set (documents plus questions with the indices of their
+relevant documents), optionally padded with synthetic distractor passages, and
+reports precision@k, recall@k, MRR, per-query latency and the context size that
+ends up in the prompt.
+
+    python bench_retrieval.py
+    python bench_retrieval.py --distractors 5000 --rerank-model cross-encoder/ms-marco-MiniLM-L-6-v2
+    python bench_retrieval.py --qa my_questions.json --k 3 5
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from loadtest import percentile
+from rag_engine import RAGEngine
+from rerank import CrossEncoderReranker
+
+
+def distractors(documents, n, seed=0):
+    """Passages that reuse the corpus vocabulary without answering anything"""
+    rng = random.Random(seed)
+    words = [w.strip(".,;'") for doc in documents for w in doc.split() if len(w) > 3]
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(12, 30))) + "." for _ in range(n)]
+
+
+def evaluate(search, questions, ks, context_k):
+    """search(question, k) -> list of doc ids"""
+    kmax = max(ks + [context_k])
+    hits = {k: 0 for k in ks}
+    found = {k: 0 for k in ks}
+    relevant_total = 0
+    rr = 0.0
+    latencies = []
+    context_chars = []
+    for item in questions:
+        relevant = set(item["relevant"])
+        start = time.perf_counter()
+        ids = search(item["question"], kmax)
+        latencies.append((time.perf_counter() - start) * 1000)
+        relevant_total += len(relevant)
+        for k in ks:
+            top = ids[:k]
+            hits[k] += sum(1 for i in top if i in relevant)
+            found[k] += len(relevant & set(top))
+        rank = next((r for r, i in enumerate(ids) if i in relevant), None)
+        rr += 1 / (rank + 1) if rank is not None else 0
+        context_chars.append(len(search.context(ids[:context_k])))
+    n = len(questions)
+    return {
+        **{f"P@{k}": hits[k] / (n * k) for k in ks},
+        **{f"R@{k}": found[k] / relevant_total for k in ks},
+        "MRR": rr / n,
+        "p50 ms": percentile(latencies, 50),
+        "p99 ms": percentile(latencies, 99),
+        "ctx chars": sum(context_chars) / n,
+    }
+
+
+class Searcher:
+    def __init__(self, rag, ids_by_text, mode):
+        self.rag = rag
+        self.ids_by_text = ids_by_text
+        self.mode = mode
+
+    def __call__(self, question, k):
+        if self.mode == "bm25":
+            ids, _ = self.rag.lexical.search(question, k)
+            return ids.tolist()
+        return [self.ids_by_text[doc] for doc in self.rag.search(question, k)]
+
+    def context(self, ids):
+        return "\n".join(self.rag.get_document(i) for i in ids)
+
+
+def main(args):
+    with open(args.qa) as f:
+        qa = json.load(f)
+    documents = qa["documents"] + distractors(qa["documents"], args.distractors)
+    questions = qa["questions"]
+
+    reranker = None
+    if args.rerank_model:
+        reranker = CrossEncoderReranker(args.rerank_model, max_candidates=args.rerank_candidates, max_ms=args.rerank_ms)
+    rag = RAGEngine(model_name=args.model, max_batch=1, fusion_candidates=args.fusion_candidates, reranker=reranker)
+    start = time.perf_counter()
+    rag.add_documents(documents)
+    print(f"{len(documents)} documents ({args.distractors} distractors), {len(questions)} questions, "
+          f"indexed in {time.perf_counter() - start:.1f}s")
+
+    ids_by_text = {}
+    for i, doc in enumerate(documents):
+        ids_by_text.setdefault(doc, i)
+
+    modes = [("vector", False, False), ("bm25", None, False), ("hybrid", True, False)]
+    if reranker is not None:
+        modes += [("vector + rerank", False, True), ("hybrid + rerank", True, True)]
+
+    rows = []
+    for label, hybrid, rerank in modes:
+        rag.hybrid = bool(hybrid)
+        rag.reranker = reranker if rerank else None
+        searcher = Searcher(rag, ids_by_text, "bm25" if hybrid is None else "engine")
+        # One untimed pass so lazy initialisation doesn't land in the first query
+        evaluate(searcher, questions[:3], args.k, args.context_k)
+        rows.append((label, evaluate(searcher, questions, args.k, args.context_k)))
+
+    columns = list(rows[0][1])
+    print(f"\n{'':<18}" + "".join(f"{c:>11}" for c in columns))
+    for label, metrics in rows:
+        print(f"{label:<18}" + "".join(f"{metrics[c]:>11.3f}" if "ms" not in c and "chars" not in c
+                                        else f"{metrics[c]:>11.1f}" for c in columns))
+    if reranker is not None:
+        print(f"\nrerank: {reranker.info()}")
+    print(f"\nctx chars = context for the top {args.context_k} (what /ask_rag sends); roughly 4 chars per prompt token")
+    rag.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qa", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "eval", "lore_qa.json"))
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--context-k", type=int, default=3, help="documents per prompt for the context size column")
+    parser.add_argument("--distractors", type=int, default=2000)
+    parser.add_argument("--fusion-candidates", type=int, default=20)
+    parser.add_argument("--rerank-model", default=None, help="cross-encoder to also evaluate reranking with")
+    parser.add_argument("--rerank-candidates", type=int, default=20)
+    parser.add_argument("--rerank-ms", type=float, default=50)
+    main(parser.parse_args())
@@ -0,0 +1,178 @@
+"""Cold start benchmark.
+
+Phases: runs a fresh interpreter per configuration and times importing the
+engine, loading the model, loading the index from --data-path, warmup, and the
+first query before and after warmup.
+
+Server: starts the API (uvicorn, or gunicorn with --gunicorn) and times until
+/health/live and /health/ready answer, then reports process memory. Under
+gunicorn the PSS total shows how much of the model the workers share.
+
+    python bench_startup.py --data-path rag_data
+    python bench_startup.py --data-path rag_data --onnx models/minilm-onnx-int8
+    python bench_startup.py --gunicorn --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from loadtest import percentile, start_server
+
+
+def phases(data_path, onnx_path):
+    """Time each startup step in this (fresh) process and print them as JSON"""
+    timings = {}
+    t0 = time.perf_counter()
+    from rag_engine import RAGEngine
+    timings["import"] = time.perf_counter() - t0
+
+    rag = RAGEngine(max_batch=1, onnx_model_path=onnx_path)
+    t0 = time.perf_counter()
+    rag.load_model()
+    timings["model"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    if rag.exists(data_path):
+        rag.load(data_path)
+    timings["index"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    rag.search("Who guards Urithiru?", k=3)
+    timings["first_query_cold"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    rag.warmup()
+    timings["warmup"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    rag.search("What is a highstorm?", k=3)
+    timings["first_query_warm"] = time.perf_counter() - t0
+    timings["documents"] = rag.num_documents
+    rag.close()
+    print(json.dumps(timings))
+
+
+def run_phases(args, onnx_path):
+    cmd = [sys.executable, __file__, "--phases", "--data-path", args.data_path]
+    if onnx_path:
+        cmd += ["--onnx", onnx_path]
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def memory_kb(pid):
+    """(RSS, PSS) of a process in kB; PSS splits shared pages between the processes sharing them"""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    values[key] = int(rest.split()[0])
+    except OSError:
+        return None, None
+    return values.get("Rss"), values.get("Pss")
+
+
+def process_tree(pid):
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(p) for p in f.read().split()]
+    except OSError:
+        pass
+    return pids
+
+
+async def time_server(args, env):
+    if args.gunicorn:
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "app_with_rag:app"],
+            env=dict(env, BIND=f"127.0.0.1:{args.port}", WEB_CONCURRENCY=str(args.workers)),
+        )
+    else:
+        proc = start_server("app_with_rag:app", args.port, env)
+
+    base = f"http://127.0.0.1:{args.port}"
+    start = time.perf_counter()
+    live = ready = None
+    # Under gunicorn each probe lands on some worker; ask until every worker had a chance to say ready
+    ready_in_a_row = 0
+    try:
+        async with httpx.AsyncClient(timeout=5) as client:
+            while time.perf_counter() - start < args.timeout:
+                try:
+                    if live is None:
+                        (await client.get(f"{base}/health/live")).raise_for_status()
+                        live = time.perf_counter() - start
+                    resp = await client.get(f"{base}/health/ready")
+                    if resp.status_code == 200:
+                        ready_in_a_row += 1
+                        if ready_in_a_row >= (args.workers * 3 if args.gunicorn else 1):
+                            ready = time.perf_counter() - start
+                            break
+                    else:
+                        ready_in_a_row = 0
+                        if resp.json().get("state") == "failed":
+                            raise RuntimeError(f"startup failed: {resp.json().get('error')}")
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.05)
+        if ready is None:
+            raise RuntimeError(f"server not ready within {args.timeout}s")
+
+        rss = pss = 0
+        for pid in process_tree(proc.pid):
+            r, p = memory_kb(pid)
+            rss += r or 0
+            pss += p or 0
+        return live, ready, rss / 1024, pss / 1024
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main(args):
+    if args.phases:
+        phases(args.data_path, args.onnx)
+        return
+
+    configs = [("sentence-transformers", None)]
+    if args.onnx:
+        configs.append(("onnx", args.onnx))
+    keys = ["import", "model", "index", "first_query_cold", "warmup", "first_query_warm"]
+    print(f"{'phases (ms)':<22}" + "".join(f"{k:>18}" for k in keys))
+    for label, onnx_path in configs:
+        runs = [run_phases(args, onnx_path) for _ in range(args.runs)]
+        print(f"{label:<22}" + "".join(f"{percentile([r[k] * 1000 for r in runs], 50):>18.1f}" for k in keys))
+
+    env = dict(os.environ, RAG_DATA_PATH=args.data_path)
+    env.setdefault("OPENAI_API_KEY", "sk-startup-bench")
+    server = "gunicorn x%d" % args.workers if args.gunicorn else "uvicorn"
+    for label, onnx_path in configs:
+        run_env = dict(env, RAG_ONNX_MODEL_PATH=onnx_path or "")
+        results = [asyncio.run(time_server(args, run_env)) for _ in range(args.runs)]
+        print(f"\n{server}, {label} ({args.runs} runs, median)")
+        print(f"  time to live   {percentile([r[0] for r in results], 50) * 1000:8.0f} ms")
+        print(f"  time to ready  {percentile([r[1] for r in results], 50) * 1000:8.0f} ms")
+        print(f"  RSS total      {percentile([r[2] for r in results], 50):8.0f} MB")
+        print(f"  PSS total      {percentile([r[3] for r in results], 50):8.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-path", default=os.getenv("RAG_DATA_PATH", "rag_data"))
+    parser.add_argument("--onnx", default=None, help="exported model dir (embedding_onnx.py) to compare against")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--gunicorn", action="store_true", help="start gunicorn with gunicorn_conf.py instead of uvicorn")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=180)
+    parser.add_argument("--phases", action="store_true", help=argparse.SUPPRESS)
+    main(parser.parse_args())
@@ -0,0 +1,135 @@
+"""Time-to-first-token harness for the streaming endpoints.
+
+Starts stub_llm.py (streaming fake LLM) and the API under test, then compares
+the streaming endpoint's time to context / first token / done with the total
+latency of the non-streaming endpoint. Finally it opens streams, hangs up after
+the first token (so the upstream LLM stream is known to be running) and checks
+(via the stub's /stats) that the upstream LLM requests were cancelled too.
+
+    python bench_stream.py --app app_with_rag:app --endpoint /ask_rag
+    python bench_stream.py --app app:app --endpoint /ask --levels 1 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+from loadtest import QUESTIONS, percentile, start_server, wait_ready
+from stub_llm import ANSWER
+
+ANSWER_TOKENS = ANSWER.split(" ")
+
+
+async def stream_once(client, url, question):
+    """Returns (time to first event, time to first token, total) in seconds"""
+    start = time.perf_counter()
+    first_event = first_token = None
+    async with client.stream("POST", url, params={"format": "ndjson"}, json={"question": question}) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            now = time.perf_counter() - start
+            if first_event is None:
+                first_event = now
+            if event["type"] == "token" and first_token is None:
+                first_token = now
+            if event["type"] == "error":
+                raise RuntimeError(event["detail"])
+    return first_event, first_token, time.perf_counter() - start
+
+
+async def blocking_once(client, url, question):
+    start = time.perf_counter()
+    resp = await client.post(url, json={"question": question})
+    resp.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def hang_up(client, url, question) -> bool:
+    """Disconnect after the first token; False if the stream ended without one"""
+    async with client.stream("POST", url, params={"format": "ndjson"}, json={"question": question}) as resp:
+        async for line in resp.aiter_lines():
+            if line and json.loads(line)["type"] == "token":
+                return True
+    return False
+
+
+def row(label, values):
+    values = [v * 1000 for v in values if v is not None]
+    if not values:
+        return f"{label:<22} {'-':>9} {'-':>9}"
+    return f"{label:<22} {percentile(values, 50):>9.1f} {percentile(values, 99):>9.1f}"
+
+
+async def main(args):
+    env = dict(os.environ)
+    env["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.stub_port}/v1"
+    env.setdefault("OPENAI_API_KEY", "sk-stub")
+    env["STUB_LLM_DELAY_MS"] = str(args.ttft_ms)
+    env["STUB_LLM_TOKEN_MS"] = str(args.token_ms)
+    env["ANSWER_CACHE_ENABLED"] = "0"
+
+    stub = start_server("stub_llm:app", args.stub_port, env)
+    api = start_server(args.app, args.port, env)
+    try:
+        await wait_ready(f"http://127.0.0.1:{args.stub_port}/docs")
+        await wait_ready(f"http://127.0.0.1:{args.port}/docs")
+        base = f"http://127.0.0.1:{args.port}"
+        stream_url = f"{base}{args.endpoint}_stream"
+        blocking_url = f"{base}{args.endpoint}"
+
+        async with httpx.AsyncClient(timeout=args.timeout, limits=httpx.Limits(max_connections=None)) as client:
+            for concurrency in args.levels:
+                n = max(concurrency * args.requests_per_worker, args.min_requests)
+                questions = [QUESTIONS[i % len(QUESTIONS)] for i in range(n)]
+                sem = asyncio.Semaphore(concurrency)
+
+                async def limited(fn, q):
+                    async with sem:
+                        return await fn(client, stream_url if fn is stream_once else blocking_url, q)
+
+                streamed = await asyncio.gather(*(limited(stream_once, q) for q in questions))
+                blocking = await asyncio.gather(*(limited(blocking_once, q) for q in questions))
+
+                print(f"\nconcurrency {concurrency}, {n} requests")
+                print(f"{'':<22} {'p50 ms':>9} {'p99 ms':>9}")
+                print(row("stream first event", [s[0] for s in streamed]))
+                print(row("stream first token", [s[1] for s in streamed]))
+                print(row("stream done", [s[2] for s in streamed]))
+                print(row("non-stream response", blocking))
+
+            before = (await client.get(f"http://127.0.0.1:{args.stub_port}/stats")).json()
+            hung_up = sum(await asyncio.gather(*(hang_up(client, stream_url, q) for q in QUESTIONS * 2)))
+            # Long enough for any upstream stream that was not cancelled to finish
+            await asyncio.sleep(len(ANSWER_TOKENS) * args.token_ms / 1000 + 1)
+            after = (await client.get(f"http://127.0.0.1:{args.stub_port}/stats")).json()
+            cancelled = after["streams_cancelled"] - before["streams_cancelled"]
+            completed = after["streams_completed"] - before["streams_completed"]
+            dropped = after["requests_disconnected"] - before["requests_disconnected"]
+            print(f"\nhung up on {hung_up} streams after their first token: upstream cancelled {cancelled}, "
+                  f"completed anyway {completed}, dropped before streaming {dropped}")
+    finally:
+        api.terminate()
+        stub.terminate()
+        api.wait()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="app_with_rag:app", help="uvicorn target of the API under test")
+    parser.add_argument("--endpoint", default="/ask_rag", help="non-streaming endpoint; <endpoint>_stream is streamed")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--stub-port", type=int, default=9000)
+    parser.add_argument("--ttft-ms", type=float, default=800, help="stub LLM time to first token")
+    parser.add_argument("--token-ms", type=float, default=30, help="stub LLM gap between tokens")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests-per-worker", type=int, default=2)
+    parser.add_argument("--min-requests", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=60)
+    asyncio.run(main(parser.parse_args()))
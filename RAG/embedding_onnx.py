@@ -0,0 +1,93 @@
+"""ONNX export (optionally int8-quantized) of the sentence embedding model.
+
+Export once:
+
+    python embedding_onnx.py --out models/minilm-onnx-int8
+
+then run the API with RAG_ONNX_MODEL_PATH=models/minilm-onnx-int8. Needs the
+optional packages in requirements-onnx.txt.
+"""
+import argparse
+import os
+from typing import List
+
+import numpy as np
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_FILE = "model_quantized.onnx"
+
+
+def _require(package: str):
+    raise RuntimeError(f"{package} is required for ONNX embeddings: pip install -r requirements-onnx.txt")
+
+
+def export(model_name: str, out_dir: str, quantize: bool = True):
+    """Export model_name to out_dir as ONNX, plus a dynamically quantized int8 copy"""
+    try:
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+    except ImportError:
+        _require("optimum[onnxruntime]")
+
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    model.save_pretrained(out_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(out_dir)
+
+    if quantize:
+        # Dynamic quantization needs no calibration data; avx2 kernels run on any recent x86 CPU
+        quantizer = ORTQuantizer.from_pretrained(out_dir, file_name=MODEL_FILE)
+        config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=out_dir, quantization_config=config)
+
+
+class OnnxEncoder:
+    """Drop-in for SentenceTransformer.encode using onnxruntime (mean pooling + L2 norm, as MiniLM does)"""
+
+    def __init__(self, path: str, threads: int = 0):
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError:
+            _require("onnxruntime")
+
+        model_file = QUANTIZED_FILE if os.path.exists(os.path.join(path, QUANTIZED_FILE)) else MODEL_FILE
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            os.path.join(path, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        self.model_file = model_file
+
+    def encode(self, sentences: List[str], batch_size: int = 32, **kwargs) -> np.ndarray:
+        outputs = []
+        for start in range(0, len(sentences), batch_size):
+            batch = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=256,
+                return_tensors="np",
+            )
+            feeds = {k: v.astype("int64") for k, v in batch.items() if k in self.input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+            mask = batch["attention_mask"][..., None].astype("float32")
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            outputs.append(pooled.astype("float32"))
+        if not outputs:
+            return np.zeros((0, 0), dtype="float32")
+        return np.concatenate(outputs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--no-quantize", action="store_true")
+    args = parser.parse_args()
+    export(args.model, args.out, quantize=not args.no_quantize)
+    print(f"Exported to {args.out}")
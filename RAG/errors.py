@@ -0,0 +1,73 @@
+import logging
+from typing import Dict, Optional
+
+import openai
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from metrics import ERRORS, current_request_id
+
+logger = logging.getLogger("rag.errors")
+
+
+class APIError(Exception):
+    """An error with the status, machine-readable code and pipeline stage the client should see"""
+
+    def __init__(self, status: int, code: str, detail: str, stage: str, retry_after: Optional[int] = None):
+        super().__init__(detail)
+        self.status = status
+        self.code = code
+        self.detail = detail
+        self.stage = stage
+        self.retry_after = retry_after
+
+    def body(self, request_id: Optional[str] = None) -> Dict:
+        # "detail" stays a plain string so existing clients keep working
+        return {
+            "detail": self.detail,
+            "error": {"code": self.code, "stage": self.stage, "request_id": request_id or current_request_id()},
+        }
+
+
+def llm_error(e: Exception) -> APIError:
+    """Map an OpenAI client error (after retries) to what the caller should see"""
+    if isinstance(e, openai.RateLimitError):
+        error = APIError(429, "llm_rate_limited", "The language model is rate limited, retry shortly", "llm", retry_after=5)
+    elif isinstance(e, openai.APITimeoutError):
+        error = APIError(504, "llm_timeout", "The language model did not answer in time", "llm")
+    elif isinstance(e, openai.APIConnectionError):
+        error = APIError(502, "llm_unreachable", "Could not reach the language model", "llm")
+    elif isinstance(e, openai.AuthenticationError):
+        error = APIError(502, "llm_auth", "The language model rejected our credentials", "llm")
+    elif isinstance(e, openai.APIStatusError):
+        error = APIError(502, "llm_error", f"The language model returned HTTP {e.status_code}", "llm")
+    else:
+        error = APIError(500, "llm_failed", f"Calling the language model failed ({type(e).__name__})", "llm")
+    error.__cause__ = e
+    return error
+
+
+def error_event(error: APIError) -> Dict:
+    """In-band error for streams, whose status line has already been sent"""
+    ERRORS.labels(error.stage, error.code).inc()
+    logger.warning("stream failed at %s: %s", error.stage, error.code, exc_info=error.__cause__)
+    return {"type": "error", **error.body()}
+
+
+async def api_error_handler(request: Request, exc: APIError):
+    ERRORS.labels(exc.stage, exc.code).inc()
+    if exc.status >= 500:
+        logger.warning("%s %s failed at %s: %s", request.method, request.url.path, exc.stage, exc.code, exc_info=exc.__cause__)
+    headers = {"Retry-After": str(exc.retry_after)} if exc.retry_after else None
+    return JSONResponse(exc.body(), status_code=exc.status, headers=headers)
+
+
+async def unhandled_error_handler(request: Request, exc: Exception):
+    """Anything not mapped above: log the traceback, return its type and the request ID"""
+    ERRORS.labels("unhandled", type(exc).__name__).inc()
+    logger.exception("Unhandled error in %s %s", request.method, request.url.path)
+    error = APIError(500, "internal_error", f"Internal error ({type(exc).__name__})", "unhandled")
+    # This handler runs outside MetricsMiddleware, which leaves the ID in request.state
+    request_id = getattr(request.state, "request_id", None)
+    headers = {"X-Request-ID": request_id} if request_id else None
+    return JSONResponse(error.body(request_id), status_code=500, headers=headers)
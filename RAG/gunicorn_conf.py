@@ -0,0 +1,25 @@
+"""Multi-worker deployment that loads the embedding model and index once.
+
+    gunicorn -c gunicorn_conf.py app_with_rag:app
+
+The app is imported in the master (preload_app) with RAG_PRELOAD=1, so model
+weights and the memory-mapped segments are loaded before forking and shared
+copy-on-write by all workers. Each worker then only warms up.
+
+The segment store has a single writer: the first worker to handle /add_docs or
+/ingest takes its lock, and the other workers answer those with 409. Workers
+don't see each other's writes until they restart, so with several workers add
+documents with ingest.py while the server is stopped.
+"""
+import multiprocessing
+import os
+
+os.environ.setdefault("RAG_PRELOAD", "1")
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(4, multiprocessing.cpu_count()))))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Loading the model in the master can take a while on a cold disk
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
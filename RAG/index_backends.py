@@ -0,0 +1,244 @@
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+# flat_l2 is the original brute-force L2 index, kept so existing rag_data keeps loading.
+# Every other backend compares L2-normalized vectors by inner product, i.e. cosine similarity.
+INDEX_TYPES = ("flat_l2", "flat_ip", "hnsw", "ivf_flat", "ivf_pq", "sq8")
+NEEDS_TRAINING = ("ivf_flat", "ivf_pq", "sq8")
+
+DEFAULT_PARAMS = {
+    "nlist": 1024,          # IVF cells (capped by the training set size)
+    "pq_m": 48,             # IVF-PQ sub-quantizers, must divide the embedding dim
+    "pq_nbits": 8,
+    "hnsw_m": 32,
+    "ef_construction": 200,
+    "train_size": 50000,    # vectors buffered before training; searched exactly until then
+    "nprobe": 16,
+    "ef_search": 64,
+}
+
+
+class VectorIndex:
+    """Wraps a FAISS index chosen by name, with training, tuning and persistence"""
+
+    def __init__(self, kind: str = "flat_ip", dim: Optional[int] = None, **params):
+        if kind not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type {kind!r}, expected one of {INDEX_TYPES}")
+        unknown = set(params) - set(DEFAULT_PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown index parameters: {sorted(unknown)}")
+        self.kind = kind
+        self.dim = dim
+        self.params = {**DEFAULT_PARAMS, **params}
+        p = self.params
+        for name in ("nlist", "pq_m", "pq_nbits", "hnsw_m", "ef_construction", "train_size", "nprobe", "ef_search"):
+            if p[name] < 1:
+                raise ValueError(f"{name} must be at least 1, got {p[name]}")
+        # Each PQ sub-quantizer trains 2**pq_nbits centroids, so it needs at least that many points
+        if kind == "ivf_pq" and p["train_size"] < 2 ** p["pq_nbits"]:
+            raise ValueError(f"train_size={p['train_size']} is too small for ivf_pq with pq_nbits={p['pq_nbits']}, "
+                             f"need at least {2 ** p['pq_nbits']}")
+        if dim is not None:
+            self._check_dim(dim)
+        self.index = None
+        # Vectors waiting for enough data to train the index
+        self.pending = None
+
+    @property
+    def metric(self) -> str:
+        return "l2" if self.kind == "flat_l2" else "ip"
+
+    @property
+    def trained(self) -> bool:
+        return self.index is not None and self.index.is_trained
+
+    @property
+    def ntotal(self) -> int:
+        total = self.index.ntotal if self.index is not None else 0
+        if self.pending is not None:
+            total += len(self.pending)
+        return total
+
+    def _prepare(self, vectors) -> np.ndarray:
+        vectors = np.ascontiguousarray(np.asarray(vectors, dtype="float32"))
+        if self.metric == "ip":
+            vectors = vectors.copy()
+            faiss.normalize_L2(vectors)
+        return vectors
+
+    def _check_dim(self, dim: int):
+        if self.kind == "ivf_pq" and dim % self.params["pq_m"]:
+            raise ValueError(f"pq_m={self.params['pq_m']} must divide the embedding dim {dim}")
+
+    def _build(self, n_train: int):
+        p = self.params
+        d = self.dim
+        ip = faiss.METRIC_INNER_PRODUCT
+        if self.kind == "flat_l2":
+            return faiss.IndexFlatL2(d)
+        if self.kind == "flat_ip":
+            return faiss.IndexFlatIP(d)
+        if self.kind == "hnsw":
+            index = faiss.IndexHNSWFlat(d, p["hnsw_m"], ip)
+            index.hnsw.efConstruction = p["ef_construction"]
+            return index
+        if self.kind == "sq8":
+            return faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, ip)
+        # FAISS wants roughly 39 training points per centroid
+        nlist = max(1, min(p["nlist"], n_train // 39))
+        quantizer = faiss.IndexFlatIP(d)
+        if self.kind == "ivf_flat":
+            return faiss.IndexIVFFlat(quantizer, d, nlist, ip)
+        return faiss.IndexIVFPQ(quantizer, d, nlist, p["pq_m"], p["pq_nbits"], ip)
+
+    def add(self, vectors):
+        """Add vectors; trained backends buffer until train_size vectors have arrived"""
+        vectors = self._prepare(vectors)
+        if self.dim is None:
+            self._check_dim(vectors.shape[1])
+            self.dim = vectors.shape[1]
+
+        if self.kind not in NEEDS_TRAINING:
+            if self.index is None:
+                self.index = self._build(len(vectors))
+                self._apply_search_params()
+            self.index.add(vectors)
+            return
+
+        if self.trained:
+            self.index.add(vectors)
+            return
+
+        previous = self.pending
+        self.pending = vectors if previous is None else np.vstack([previous, vectors])
+        if len(self.pending) >= self.params["train_size"]:
+            try:
+                self.train()
+            except Exception:
+                # Leave the index as it was before this add
+                self.pending = previous
+                raise
+
+    def train(self):
+        """Train on the buffered vectors (the first train_size added) and index them"""
+        if self.pending is None or not len(self.pending):
+            return
+        train = self.pending[: self.params["train_size"]]
+        # nlist is sized from the training sample, which may be smaller than the buffer
+        index = self._build(len(train))
+        index.train(train)
+        index.add(self.pending)
+        self.index = index
+        self.pending = None
+        self._apply_search_params()
+
+    def search(self, queries, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = self._prepare(queries)
+        if self.pending is not None:
+            # Not trained yet: exact search over the buffer
+            scores = queries @ self.pending.T
+            k_eff = min(k, scores.shape[1])
+            order = np.argsort(-scores, axis=1)[:, :k_eff]
+            distances = np.take_along_axis(scores, order, axis=1)
+            indices = order.astype("int64")
+            if k_eff < k:
+                pad = k - k_eff
+                indices = np.pad(indices, ((0, 0), (0, pad)), constant_values=-1)
+                distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=-np.inf)
+            return distances, indices
+        if self.index is None:
+            return (np.full((len(queries), k), -np.inf, dtype="float32"),
+                    np.full((len(queries), k), -1, dtype="int64"))
+        return self.index.search(queries, k)
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """Tune the recall/latency trade-off at runtime"""
+        for name, value in (("nprobe", nprobe), ("ef_search", ef_search)):
+            if value is not None and value < 1:
+                raise ValueError(f"{name} must be >= 1")
+        if nprobe is not None:
+            self.params["nprobe"] = nprobe
+        if ef_search is not None:
+            self.params["ef_search"] = ef_search
+        self._apply_search_params()
+
+    def _apply_search_params(self):
+        if self.index is None:
+            return
+        if self.kind.startswith("ivf"):
+            faiss.extract_index_ivf(self.index).nprobe = self.params["nprobe"]
+        elif self.kind == "hnsw":
+            self.index.hnsw.efSearch = self.params["ef_search"]
+
+    def memory_bytes(self) -> int:
+        size = len(faiss.serialize_index(self.index)) if self.index is not None else 0
+        if self.pending is not None:
+            size += self.pending.nbytes
+        return size
+
+    def info(self) -> Dict:
+        return {"type": self.kind, "metric": self.metric, "ntotal": self.ntotal,
+                "trained": self.trained, "params": self.params}
+
+    def meta(self) -> Dict:
+        return {"type": self.kind, "dim": self.dim, "params": dict(self.params)}
+
+    @classmethod
+    def from_meta(cls, meta: Dict) -> "VectorIndex":
+        return cls(meta["type"], meta.get("dim"), **meta.get("params", {}))
+
+    def copy(self) -> "VectorIndex":
+        """Independent copy, e.g. to serialize without holding the caller's lock"""
+        vi = VectorIndex.from_meta(self.meta())
+        if self.index is not None:
+            vi.index = faiss.clone_index(self.index)
+            vi._apply_search_params()
+        if self.pending is not None:
+            vi.pending = self.pending.copy()
+        return vi
+
+    def reconstruct_all(self) -> Optional[np.ndarray]:
+        """Stored vectors in insertion order, or None if the index type can't return them"""
+        if self.index is None:
+            return self.pending
+        if self.kind not in ("flat_l2", "flat_ip"):
+            return None
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        return vectors if self.pending is None else np.vstack([vectors, self.pending])
+
+    def save(self, path: str):
+        meta = self.meta()
+        with open(os.path.join(path, "index_meta.json"), "w") as f:
+            json.dump(meta, f)
+        if self.index is not None:
+            faiss.write_index(self.index, os.path.join(path, "index.faiss"))
+        pending_path = os.path.join(path, "index_pending.npy")
+        if self.pending is not None:
+            np.save(pending_path, self.pending)
+        elif os.path.exists(pending_path):
+            os.remove(pending_path)
+
+    @classmethod
+    def load(cls, path: str) -> "VectorIndex":
+        meta_path = os.path.join(path, "index_meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        else:
+            # Data saved before index types existed
+            meta = {"type": "flat_l2", "dim": None, "params": {}}
+        vi = cls.from_meta(meta)
+        index_path = os.path.join(path, "index.faiss")
+        if os.path.exists(index_path):
+            vi.index = faiss.read_index(index_path)
+            vi.dim = vi.index.d
+            vi._apply_search_params()
+        pending_path = os.path.join(path, "index_pending.npy")
+        if os.path.exists(pending_path):
+            vi.pending = np.load(pending_path)
+            vi.dim = vi.pending.shape[1]
+        return vi
@@ -0,0 +1,423 @@
+"""Bulk ingestion of lore files into the RAG knowledge base.
+
+Files are split into records (paragraphs for plain text, heading sections for
+markdown, one row for JSONL), records are chunked with overlap, chunks already
+in the knowledge base are skipped by content hash, and the rest are encoded in
+batches (optionally across a process pool) and committed as segments.
+
+Progress is checkpointed per file in <data-path>/ingest_checkpoint.json, so an
+interrupted run picks up where it left off when started again.
+
+    python ingest.py lore/*.md compendium.jsonl --data-path rag_data --workers 4
+
+A running API server that has written to the data path owns it (see
+segment_store.py), and this then exits; use its POST /ingest endpoint instead.
+Servers started before this run only see its documents once restarted.
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from segment_store import content_hash
+
+FORMATS = ("text", "markdown", "jsonl")
+CHECKPOINT = "ingest_checkpoint.json"
+
+
+def detect_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".md", ".markdown"):
+        return "markdown"
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    return "text"
+
+
+class RecordSplitter:
+    """Turns a stream of lines into records: paragraphs, markdown sections or JSONL rows"""
+
+    def __init__(self, fmt: str, text_field: str = "text"):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format {fmt!r}, expected one of {FORMATS}")
+        self.fmt = fmt
+        self.text_field = text_field
+        self.lines: List[str] = []
+
+    def feed(self, line: str) -> List[str]:
+        line = line.rstrip("\r\n")
+        if self.fmt == "jsonl":
+            if not line.strip():
+                return []
+            row = json.loads(line)
+            if isinstance(row, dict):
+                text = row.get(self.text_field, "")
+            elif isinstance(row, str):
+                text = row
+            else:
+                raise ValueError(f"JSONL rows must be objects or strings, got {type(row).__name__}")
+            if not isinstance(text, str):
+                raise ValueError(f"Field {self.text_field!r} must be a string, got {type(text).__name__}")
+            return [text] if text.strip() else []
+        if self.fmt == "text" and not line.strip():
+            return self.flush()
+        if self.fmt == "markdown" and line.lstrip().startswith("#"):
+            records = self.flush()
+            self.lines.append(line)
+            return records
+        self.lines.append(line)
+        return []
+
+    def flush(self) -> List[str]:
+        text = "\n".join(self.lines).strip()
+        self.lines = []
+        return [text] if text else []
+
+
+def iter_file_records(path: str, fmt: Optional[str] = None, text_field: str = "text") -> Iterator[str]:
+    splitter = RecordSplitter(fmt or detect_format(path), text_field)
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield from splitter.feed(line)
+    yield from splitter.flush()
+
+
+def check_chunking(chunk_size: int, overlap: int):
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    if overlap < 0:
+        raise ValueError("overlap must not be negative")
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+
+
+def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
+    """Split text into ~chunk_size character chunks that overlap by ~overlap characters"""
+    check_chunking(chunk_size, overlap)
+    text = text.strip()
+    if len(text) <= chunk_size:
+        return [text] if text else []
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + chunk_size)
+        if end < len(text):
+            # Prefer to cut at whitespace in the second half of the window
+            cut = text.rfind(" ", start + chunk_size // 2, end)
+            if cut == -1:
+                cut = text.rfind("\n", start + chunk_size // 2, end)
+            if cut > start:
+                end = cut
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        next_start = max(end - overlap, start + 1)
+        # Don't start the next chunk mid-word
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return [c for c in chunks if c]
+
+
+# Process pool workers each load the model once
+_worker_model = None
+
+
+def _init_worker(model_name: str, onnx_model_path: Optional[str] = None):
+    global _worker_model
+    # The same encoder as the engine, so ingested vectors match the query vectors
+    if onnx_model_path:
+        from embedding_onnx import OnnxEncoder
+        _worker_model = OnnxEncoder(onnx_model_path)
+    else:
+        from sentence_transformers import SentenceTransformer
+        _worker_model = SentenceTransformer(model_name)
+
+
+def _encode(texts: List[str]) -> np.ndarray:
+    return np.asarray(_worker_model.encode(texts, batch_size=64), dtype="float32")
+
+
+class IngestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.records = 0
+        self.chunks = 0
+        self.duplicates = 0
+        self.added = 0
+        self.commits = 0
+
+    def as_dict(self) -> Dict:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return {
+            "records": self.records,
+            "chunks": self.chunks,
+            "duplicates": self.duplicates,
+            "added": self.added,
+            "commits": self.commits,
+            "elapsed_s": round(elapsed, 2),
+            "docs_per_s": round(self.added / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+class IngestPipeline:
+    def __init__(
+        self,
+        engine,
+        data_path: str,
+        chunk_size: int = 1000,
+        overlap: int = 200,
+        batch_size: int = 256,
+        workers: int = 0,
+        commit_every: int = 8,
+        resume: bool = True,
+        progress: Optional[Callable[[Dict], None]] = None,
+    ):
+        check_chunking(chunk_size, overlap)
+        self.engine = engine
+        self.data_path = data_path
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.resume = resume
+        self.progress = progress
+        self.stats = IngestStats()
+        # workers=0 encodes on the calling thread with the engine's model
+        self.pool = None
+        self.max_in_flight = 1
+        if workers > 0:
+            self.pool = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(engine.model_name, engine.onnx_model_path),
+            )
+            self.max_in_flight = workers * 2
+        self._in_flight = deque()
+        self._seen = set()
+        self._uncommitted = 0
+        self._source = None
+        self._position = 0
+
+    # ---- checkpoints ---------------------------------------------------
+
+    def _checkpoint_path(self) -> str:
+        return os.path.join(self.data_path, CHECKPOINT)
+
+    def _read_checkpoint(self) -> Dict:
+        try:
+            with open(self._checkpoint_path(), "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _write_checkpoint(self):
+        if self._source is None:
+            return
+        state = self._read_checkpoint()
+        state[self._source] = self._position
+        tmp = self._checkpoint_path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self._checkpoint_path())
+
+    # ---- pipeline ------------------------------------------------------
+
+    def ingest(self, records: Iterable[str], source: Optional[str] = None) -> Dict:
+        """Chunk, dedupe, encode and commit records; source names the checkpoint entry"""
+        self._source = source
+        skip = self._read_checkpoint().get(source, 0) if (source and self.resume) else 0
+        # Number of leading records whose chunks are all committed
+        self._position = skip
+        known = self.engine.known_hashes()
+        batch: List[str] = []
+        hashes: List[int] = []
+        total = skip
+
+        for position, record in enumerate(records):
+            if position < skip:
+                continue
+            total = position + 1
+            self.stats.records += 1
+            for chunk in chunk_text(record, self.chunk_size, self.overlap):
+                self.stats.chunks += 1
+                h = content_hash(chunk)
+                if h in known or h in self._seen:
+                    self.stats.duplicates += 1
+                    continue
+                self._seen.add(h)
+                batch.append(chunk)
+                hashes.append(h)
+                if len(batch) >= self.batch_size:
+                    # Cut mid-record: on resume this record is re-read and its added chunks deduped
+                    self._submit(batch, hashes, position)
+                    batch, hashes = [], []
+
+        if batch:
+            self._submit(batch, hashes, total)
+        while self._in_flight:
+            self._complete_oldest()
+        self._position = total
+        self._commit()
+        return self.stats.as_dict()
+
+    def _submit(self, texts: List[str], hashes: List[int], position: int):
+        if self.pool is not None:
+            future = self.pool.submit(_encode, texts)
+        else:
+            future = Future()
+            future.set_result(self.engine.model.encode(texts, batch_size=64))
+        self._in_flight.append((texts, hashes, position, future))
+        while len(self._in_flight) >= self.max_in_flight:
+            self._complete_oldest()
+
+    def _complete_oldest(self):
+        texts, hashes, position, future = self._in_flight.popleft()
+        self.engine.add_embeddings(texts, future.result())
+        # The engine's hash set covers these now
+        self._seen.difference_update(hashes)
+        self.stats.added += len(texts)
+        self._position = position
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self._commit()
+
+    def _commit(self):
+        self.engine.save(self.data_path)
+        self._write_checkpoint()
+        self._uncommitted = 0
+        self.stats.commits += 1
+        if self.progress is not None:
+            self.progress(self.stats.as_dict())
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+class IngestJob:
+    """Runs an IngestPipeline on a background thread, fed records through a bounded queue"""
+
+    _DONE = object()
+
+    def __init__(self, pipeline: IngestPipeline, max_queued: int = 64):
+        self.id = uuid.uuid4().hex
+        self.pipeline = pipeline
+        self.stats = pipeline.stats
+        self.status = "running"
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.thread = threading.Thread(target=self._run, name=f"rag-ingest-{self.id[:8]}", daemon=True)
+        self.thread.start()
+
+    def _records(self) -> Iterator[str]:
+        while True:
+            records = self.queue.get()
+            if records is self._DONE:
+                return
+            yield from records
+
+    def _run(self):
+        try:
+            self.pipeline.ingest(self._records())
+            self.status = "done"
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            # Unblock a producer still waiting on a full queue
+            while not self.queue.empty():
+                self.queue.get_nowait()
+        finally:
+            self.stats.finished = time.perf_counter()
+            self.pipeline.close()
+            # Finished jobs are kept for their status; the pipeline (seen hashes, pool) is not needed
+            self.pipeline = None
+
+    def put(self, records: List[str]):
+        """Blocks while the pipeline is behind, which pushes back on the uploader"""
+        if self.status == "running":
+            self.queue.put(records)
+
+    def finish(self):
+        if self.status == "running":
+            self.queue.put(self._DONE)
+
+    def info(self) -> Dict:
+        return {"job_id": self.id, "status": self.status, "error": self.error, **self.stats.as_dict()}
+
+
+def main(args):
+    from rag_engine import RAGEngine
+    from segment_store import ReadOnlyStore
+
+    engine = RAGEngine(
+        model_name=args.model,
+        onnx_model_path=args.onnx_model_path,
+        max_batch=1,
+        index_type=args.index_type,
+        index_params=json.loads(args.index_params),
+    )
+    if engine.exists(args.data_path):
+        engine.load(args.data_path)
+    os.makedirs(args.data_path, exist_ok=True)
+    try:
+        engine.acquire_writer(args.data_path)
+    except ReadOnlyStore as e:
+        engine.close()
+        raise SystemExit(f"Can't ingest: {e}")
+
+    def report(stats):
+        print(f"  {stats['added']} added, {stats['duplicates']} duplicates, "
+              f"{stats['docs_per_s']} docs/s, {stats['elapsed_s']}s", flush=True)
+
+    pipeline = IngestPipeline(
+        engine,
+        args.data_path,
+        chunk_size=args.chunk_size,
+        overlap=args.overlap,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        commit_every=args.commit_every,
+        resume=not args.no_resume,
+        progress=report,
+    )
+    try:
+        for path in args.files:
+            print(f"Ingesting {path}")
+            records = iter_file_records(path, None if args.format == "auto" else args.format, args.text_field)
+            pipeline.ingest(records, source=os.path.abspath(path))
+    finally:
+        pipeline.close()
+        engine.close()
+    stats = pipeline.stats.as_dict()
+    print(f"Done: {stats['added']} chunks added from {stats['records']} records "
+          f"({stats['duplicates']} duplicates) in {stats['elapsed_s']}s, {stats['docs_per_s']} docs/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--data-path", default=os.getenv("RAG_DATA_PATH", "rag_data"))
+    parser.add_argument("--format", default="auto", choices=("auto",) + FORMATS)
+    parser.add_argument("--text-field", default="text", help="JSONL field holding the text")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="characters per chunk")
+    parser.add_argument("--overlap", type=int, default=200, help="characters shared by consecutive chunks")
+    parser.add_argument("--batch-size", type=int, default=256, help="chunks per encode call")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="encoder processes (0 = in-process)")
+    parser.add_argument("--commit-every", type=int, default=8, help="batches per committed segment")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--onnx-model-path", default=os.getenv("RAG_ONNX_MODEL_PATH") or None,
+                        help="encode with this ONNX export instead of --model (use the API server's)")
+    parser.add_argument("--index-type", default=os.getenv("RAG_INDEX_TYPE", "flat_ip"))
+    parser.add_argument("--index-params", default=os.getenv("RAG_INDEX_PARAMS", "{}"))
+    parser.add_argument("--no-resume", action="store_true", help="ignore the checkpoint and re-read every file")
+    main(parser.parse_args())
@@ -0,0 +1,189 @@
+"""BM25 inverted index kept alongside the vector index.
+
+Document IDs are the engine's stable document IDs (0, 1, 2, ... in insertion
+order). A loaded index is a read-only CSR base (memory-mapped .npy files);
+documents added afterwards go to in-memory postings until the next snapshot
+merges both.
+"""
+import json
+import math
+import os
+import re
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+STOP_WORDS = frozenset(
+    "a an and are as at be by did do does for from had has have he her his how i in is it its of on or "
+    "she that the their them they this to was were what when where which who whom why will with you".split()
+)
+
+FILES = ("lexical_meta.json", "lexical_offsets.npy", "lexical_ids.npy", "lexical_tfs.npy", "lexical_lengths.npy")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without stop words; trailing possessive and plural s are stripped"""
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in STOP_WORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # Read-only base: postings of term t are ids/tfs[offsets[t]:offsets[t + 1]]
+        self.terms: Dict[str, int] = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.ids = np.zeros(0, dtype=np.uint32)
+        self.tfs = np.zeros(0, dtype=np.uint32)
+        # Postings for documents added since the base was built
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.lengths = array("I")
+        self.total_length = 0
+        # Kept up to date as documents are added, so info() never walks the postings
+        self.num_terms = 0
+        self.num_postings = 0
+
+    @property
+    def num_documents(self) -> int:
+        return len(self.lengths)
+
+    def add(self, documents: Iterable[str]):
+        """Index documents; they get the next IDs in order"""
+        for doc in documents:
+            self.add_tokens(tokenize(doc))
+
+    def add_tokens(self, tokens: List[str]):
+        doc_id = len(self.lengths)
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            entry = self.postings.get(token)
+            if entry is None:
+                entry = self.postings[token] = (array("I"), array("I"))
+                if token not in self.terms:
+                    self.num_terms += 1
+            entry[0].append(doc_id)
+            entry[1].append(tf)
+        self.num_postings += len(counts)
+        self.lengths.append(len(tokens))
+        self.total_length += len(tokens)
+
+    def _term_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        ids, tfs = [], []
+        t = self.terms.get(term)
+        if t is not None:
+            start, stop = self.offsets[t], self.offsets[t + 1]
+            ids.append(self.ids[start:stop])
+            tfs.append(self.tfs[start:stop])
+        entry = self.postings.get(term)
+        if entry is not None:
+            ids.append(np.frombuffer(entry[0], dtype=np.uint32))
+            tfs.append(np.frombuffer(entry[1], dtype=np.uint32))
+        if not ids:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32)
+        if len(ids) == 1:
+            return ids[0], tfs[0]
+        return np.concatenate(ids), np.concatenate(tfs)
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (document IDs, BM25 scores), best first"""
+        n = self.num_documents
+        if n == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        avgdl = self.total_length / n or 1.0
+        lengths = np.frombuffer(self.lengths, dtype=np.uint32)
+
+        all_ids, all_scores = [], []
+        for term in set(tokenize(query)):
+            ids, tfs = self._term_postings(term)
+            if not len(ids):
+                continue
+            df = len(ids)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            tf = tfs.astype(np.float32)
+            norm = self.k1 * (1 - self.b + self.b * lengths[ids] / avgdl)
+            all_ids.append(ids)
+            all_scores.append(idf * tf * (self.k1 + 1) / (tf + norm))
+        if not all_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        # Sum per document over the query terms it contains
+        doc_ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype(np.float32)
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return doc_ids[top].astype(np.int64), scores[top]
+
+    def copy(self) -> "BM25Index":
+        """A standalone copy with base and recent postings merged into one CSR base"""
+        terms = sorted(set(self.terms) | set(self.postings))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        ids, tfs = [], []
+        for i, term in enumerate(terms):
+            term_ids, term_tfs = self._term_postings(term)
+            ids.append(term_ids)
+            tfs.append(term_tfs)
+            offsets[i + 1] = offsets[i] + len(term_ids)
+
+        other = BM25Index(self.k1, self.b)
+        other.terms = {term: i for i, term in enumerate(terms)}
+        other.offsets = offsets
+        other.ids = np.concatenate(ids).astype(np.uint32) if ids else other.ids
+        other.tfs = np.concatenate(tfs).astype(np.uint32) if tfs else other.tfs
+        other.lengths = array("I", self.lengths)
+        other.total_length = self.total_length
+        other.num_terms = len(terms)
+        other.num_postings = int(offsets[-1])
+        return other
+
+    def info(self) -> Dict:
+        return {
+            "documents": self.num_documents,
+            "terms": self.num_terms,
+            "postings": self.num_postings,
+        }
+
+    def save(self, path: str):
+        """Write the index to path (merging recent postings into the base first)"""
+        merged = self.copy() if self.postings else self
+        terms = sorted(merged.terms, key=merged.terms.get)
+        with open(os.path.join(path, "lexical_meta.json"), "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "terms": terms}, f)
+        np.save(os.path.join(path, "lexical_offsets.npy"), merged.offsets)
+        np.save(os.path.join(path, "lexical_ids.npy"), merged.ids)
+        np.save(os.path.join(path, "lexical_tfs.npy"), merged.tfs)
+        np.save(os.path.join(path, "lexical_lengths.npy"), np.frombuffer(merged.lengths, dtype=np.uint32))
+
+    @staticmethod
+    def exists(path: Optional[str]) -> bool:
+        return bool(path) and os.path.exists(os.path.join(path, "lexical_meta.json"))
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(os.path.join(path, "lexical_meta.json")) as f:
+            meta = json.load(f)
+        index = cls(meta["k1"], meta["b"])
+        index.terms = {term: i for i, term in enumerate(meta["terms"])}
+        index.offsets = np.load(os.path.join(path, "lexical_offsets.npy"))
+        # Postings are only read, so they can stay on disk
+        index.ids = np.load(os.path.join(path, "lexical_ids.npy"), mmap_mode="r")
+        index.tfs = np.load(os.path.join(path, "lexical_tfs.npy"), mmap_mode="r")
+        index.lengths = array("I", np.load(os.path.join(path, "lexical_lengths.npy")).tobytes())
+        index.total_length = int(sum(index.lengths))
+        index.num_terms = len(index.terms)
+        index.num_postings = len(index.ids)
+        return index
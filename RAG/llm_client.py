@@ -0,0 +1,138 @@
+import asyncio
+import os
+import random
+from typing import AsyncIterator, Dict, List, Optional
+
+import openai
+
+from metrics import LLM_RETRIES, LLM_TOKENS
+
+
+# Errors worth retrying: the request never reached the model or the model was overloaded
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class LLMClient:
+    def __init__(
+        self,
+        model: str = "gpt-4",
+        max_concurrency: int = 32,
+        timeout: float = 30.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+    ):
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # One pooled HTTP client for the whole process; retries are handled here, not by the SDK
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key or os.getenv("OPENAI_API_KEY"),
+            base_url=base_url or os.getenv("OPENAI_BASE_URL"),
+            timeout=timeout,
+            max_retries=0,
+        )
+        self._max_concurrency = max_concurrency
+        self._semaphore = None
+
+    @classmethod
+    def from_env(cls) -> "LLMClient":
+        """Build a client from LLM_* environment variables"""
+        return cls(
+            model=os.getenv("LLM_MODEL", "gpt-4"),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "32")),
+            timeout=float(os.getenv("LLM_TIMEOUT", "30")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+        )
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the event loop that serves requests
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._semaphore
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def chat(self, messages: List[Dict[str, str]], temperature: float = 0.5, max_tokens: int = 256):
+        """Run a chat completion, retrying transient failures with exponential backoff"""
+        attempt = 0
+        while True:
+            try:
+                async with self.semaphore:
+                    resp = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                    )
+                if resp.usage is not None:
+                    LLM_TOKENS.labels("prompt").observe(resp.usage.prompt_tokens)
+                    LLM_TOKENS.labels("completion").observe(resp.usage.completion_tokens)
+                return resp
+            except RETRYABLE_ERRORS:
+                if attempt >= self.max_retries:
+                    raise
+            # Sleep outside the semaphore so waiting retries don't hold a slot
+            LLM_RETRIES.inc()
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    async def stream_chat(
+        self, messages: List[Dict[str, str]], temperature: float = 0.5, max_tokens: int = 256
+    ) -> AsyncIterator[str]:
+        """Yield answer text as it is generated.
+
+        Only opening the stream is retried; once tokens flow a failure is raised to
+        the caller. Closing or cancelling the generator closes the upstream HTTP
+        response, so the model stops generating for a client that went away.
+        """
+        attempt = 0
+        while True:
+            # The concurrency slot is held for the whole stream, not just the request
+            await self.semaphore.acquire()
+            try:
+                stream = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True,
+                )
+                break
+            except RETRYABLE_ERRORS:
+                self.semaphore.release()
+                if attempt >= self.max_retries:
+                    raise
+            except BaseException:
+                self.semaphore.release()
+                raise
+            LLM_RETRIES.inc()
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+        # Streamed responses carry no usage, so completion length is counted in chunks
+        chunks = 0
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks += 1
+                    yield chunk.choices[0].delta.content
+        finally:
+            LLM_TOKENS.labels("completion_stream").observe(chunks)
+            await stream.response.aclose()
+            self.semaphore.release()
+
+    async def close(self):
+        await self.client.close()
@@ -0,0 +1,124 @@
+"""Load test for /ask and /ask_rag against the local stub LLM.
+
+Starts stub_llm.py and the API under test as uvicorn subprocesses, then fires
+requests at increasing concurrency and reports latency percentiles and throughput.
+
+    python loadtest.py --app app:app --endpoint /ask
+    python loadtest.py --app app_with_rag:app --endpoint /ask_rag --levels 1 8 32 128
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+QUESTIONS = [
+    "What is Urithiru?",
+    "Who are the Radiants?",
+    "What is Stormlight?",
+    "Where did the Everstorm come from?",
+]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def start_server(target, port, env):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+
+
+async def wait_ready(url, timeout=120):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def run_level(client, url, concurrency, total):
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            start = time.perf_counter()
+            try:
+                resp = await client.post(url, json={"question": QUESTIONS[i % len(QUESTIONS)]})
+                resp.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            except httpx.HTTPError:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+async def main(args):
+    env = dict(os.environ)
+    env["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.stub_port}/v1"
+    env.setdefault("OPENAI_API_KEY", "sk-stub")
+    env["STUB_LLM_DELAY_MS"] = str(args.llm_delay_ms)
+    # The test repeats a handful of questions; measure the pipeline, not the answer cache
+    env["ANSWER_CACHE_ENABLED"] = "1" if args.cache else "0"
+
+    stub = start_server("stub_llm:app", args.stub_port, env)
+    api = start_server(args.app, args.port, env)
+    try:
+        await wait_ready(f"http://127.0.0.1:{args.stub_port}/docs")
+        await wait_ready(f"http://127.0.0.1:{args.port}/docs")
+        url = f"http://127.0.0.1:{args.port}{args.endpoint}"
+
+        limits = httpx.Limits(max_connections=max(args.levels), max_keepalive_connections=max(args.levels))
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            print(f"{'conc':>6} {'reqs':>6} {'errors':>6} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'req/s':>8}")
+            for concurrency in args.levels:
+                total = max(concurrency * args.requests_per_worker, args.min_requests)
+                latencies, errors, elapsed = await run_level(client, url, concurrency, total)
+                if not latencies:
+                    print(f"{concurrency:>6} {total:>6} {errors:>6} {'-':>9} {'-':>9} {'-':>9} {0:>8.1f}")
+                    continue
+                print(
+                    f"{concurrency:>6} {total:>6} {errors:>6} "
+                    f"{percentile(latencies, 50) * 1000:>9.1f} "
+                    f"{percentile(latencies, 99) * 1000:>9.1f} "
+                    f"{statistics.mean(latencies) * 1000:>9.1f} "
+                    f"{len(latencies) / elapsed:>8.1f}"
+                )
+    finally:
+        api.terminate()
+        stub.terminate()
+        api.wait()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="app:app", help="uvicorn target of the API under test")
+    parser.add_argument("--endpoint", default="/ask")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--stub-port", type=int, default=9000)
+    parser.add_argument("--llm-delay-ms", type=float, default=800)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests-per-worker", type=int, default=4)
+    parser.add_argument("--min-requests", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--cache", action="store_true", help="leave the answer cache enabled")
+    asyncio.run(main(parser.parse_args()))
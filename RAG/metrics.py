@@ -0,0 +1,215 @@
+"""Prometheus metrics and per-request stage timings.
+
+span("encode") times a block into the rag_stage_seconds histogram. When the
+request is traced (X-Trace: 1 request header, or RAG_TRACE_ALL=1) the timing is
+also added to the request's trace, which MetricsMiddleware returns as a
+Server-Timing header. Work handed to other threads keeps the trace: executor
+calls go through contextvars.copy_context(), and the query batcher records
+batch-level timings into the trace of every query in the batch.
+"""
+import contextvars
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent in each pipeline stage", ["stage"], buckets=LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram(
+    "rag_request_seconds", "HTTP request latency, until the last body byte", ["endpoint", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+IN_FLIGHT = Gauge("rag_requests_in_flight", "HTTP requests being served (streams count until they end)", ["endpoint"])
+LLM_TOKENS = Histogram(
+    "rag_llm_tokens", "Tokens per LLM call (streamed completions count chunks)", ["kind"],
+    buckets=(8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192),
+)
+LLM_RETRIES = Counter("rag_llm_retries_total", "LLM requests retried after a transient error")
+ERRORS = Counter("rag_errors_total", "Errors returned to clients, by pipeline stage and error code", ["stage", "code"])
+BATCH_SIZE = Histogram("rag_batch_size", "Queries per embedding micro-batch", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+class Trace:
+    """Stage timings of one request"""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.spans: List[Tuple[str, float]] = []
+
+    def add(self, stage: str, seconds: float):
+        self.spans.append((stage, seconds))
+
+    def totals_ms(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for stage, seconds in list(self.spans):
+            totals[stage] = totals.get(stage, 0.0) + seconds * 1000
+        return {stage: round(ms, 3) for stage, ms in totals.items()}
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{stage};dur={ms}" for stage, ms in self.totals_ms().items())
+
+
+class TraceGroup:
+    """Adds each span to several traces (the queries of one batch)"""
+
+    def __init__(self, traces: Iterable[Trace]):
+        self.traces = list(traces)
+
+    def add(self, stage: str, seconds: float):
+        for trace in self.traces:
+            trace.add(stage, seconds)
+
+
+_trace: contextvars.ContextVar = contextvars.ContextVar("rag_trace", default=None)
+_request_id: contextvars.ContextVar = contextvars.ContextVar("rag_request_id", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def observe(stage: str, seconds: float, trace=None):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    trace = trace if trace is not None else _trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def span(stage: str):
+    """Time the block as pipeline stage `stage`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def traced(traces: Iterable[Optional[Trace]]):
+    """Record spans in this thread into all of the given traces"""
+    traces = [t for t in traces if t is not None]
+    token = _trace.set(TraceGroup(traces) if traces else None)
+    try:
+        yield
+    finally:
+        _trace.reset(token)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: request latency, in-flight gauge, request IDs and optional trace headers"""
+
+    def __init__(self, app, trace_all: bool = False):
+        self.app = app
+        self.trace_all = trace_all
+
+    def _endpoint(self, scope) -> str:
+        # Label by route template so /ingest/{job_id} is one series
+        from starlette.routing import Match
+        for route in getattr(scope.get("app"), "routes", []):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:16]
+        traced_request = self.trace_all or headers.get(b"x-trace", b"").lower() in (b"1", b"true")
+        trace = Trace(request_id) if traced_request else None
+        endpoint = self._endpoint(scope)
+        status = 500
+
+        async def send_with_headers(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                extra = [(b"x-request-id", request_id.encode("latin-1"))]
+                # For streamed responses this only covers the stages before the first byte
+                if trace is not None and trace.spans:
+                    extra.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = dict(message, headers=list(message.get("headers", [])) + extra)
+            await send(message)
+
+        scope.setdefault("state", {})["request_id"] = request_id
+        trace_token = _trace.set(trace)
+        id_token = _request_id.set(request_id)
+        IN_FLIGHT.labels(endpoint).inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            IN_FLIGHT.labels(endpoint).dec()
+            REQUEST_SECONDS.labels(endpoint, scope["method"], str(status)).observe(time.perf_counter() - start)
+            _trace.reset(trace_token)
+            _request_id.reset(id_token)
+
+
+class EngineCollector:
+    """Index, store, batcher and cache state, read at scrape time"""
+
+    def __init__(self, rag, answer_cache=None, startup=None):
+        self.rag = rag
+        self.answer_cache = answer_cache
+        self.startup = startup
+
+    def collect(self):
+        rag = self.rag
+
+        def gauge(name, doc, value):
+            return GaugeMetricFamily(name, doc, value=value)
+
+        yield gauge("rag_documents", "Documents in the knowledge base", rag.num_documents)
+        yield gauge("rag_pending_documents", "Documents not yet committed to a segment", len(rag.pending_documents))
+        yield gauge("rag_index_vectors", "Vectors in the vector index", rag.index.ntotal)
+        yield gauge("rag_segments", "Segments in the store", len(rag.store.segments) if rag.store else 0)
+        lexical = rag.lexical.info()
+        yield gauge("rag_lexical_terms", "Distinct terms in the BM25 index", lexical["terms"])
+        yield gauge("rag_lexical_postings", "Postings in the BM25 index", lexical["postings"])
+        if self.startup is not None:
+            yield gauge("rag_ready", "1 once the model and index are loaded and warm", 1 if self.startup.ready else 0)
+
+        if rag.batcher is not None:
+            stats = rag.batcher.stats()
+            yield gauge("rag_batch_queue_depth", "Queries waiting for an embedding batch", stats["pending"])
+        if rag.reranker is not None:
+            info = rag.reranker.info()
+            yield CounterMetricFamily("rag_rerank_pairs", "Query/document pairs scored", value=info["pairs_scored"])
+            yield CounterMetricFamily(
+                "rag_rerank_budget_exhausted", "Rerank calls cut short by the time budget", value=info["budget_exhausted"]
+            )
+
+        if self.answer_cache is not None:
+            stats = self.answer_cache.stats()
+            lookups = CounterMetricFamily("rag_answer_cache_lookups", "Answer cache lookups by result", labels=["result"])
+            lookups.add_metric(["hit_exact"], stats["hits_exact"])
+            lookups.add_metric(["hit_semantic"], stats["hits_semantic"])
+            lookups.add_metric(["miss"], stats["misses"])
+            yield lookups
+            yield gauge("rag_answer_cache_entries", "Cached answers", stats["entries"])
+            yield gauge("rag_answer_cache_bytes", "Approximate answer cache size", stats["bytes"])
+            yield CounterMetricFamily(
+                "rag_answer_cache_latency_saved_seconds", "LLM time saved by cache hits", value=stats["latency_saved_s"]
+            )
+
+
+def register(collector):
+    REGISTRY.register(collector)
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
@@ -0,0 +1,130 @@
+"""In-process sampling profiler that can be switched on and off while serving.
+
+Every interval it snapshots the stacks of all Python threads (event loop,
+search executor, batcher, ingest) and counts them. Output is either the top
+functions by sample count or folded stacks ("a;b;c 42" per line), which
+flamegraph.pl and speedscope read directly.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+# Leaf frames of threads that are only waiting (idle pool workers, the event loop's select)
+IDLE_FRAMES = frozenset({
+    "threading.py:wait",
+    "threading.py:_wait_for_tstate_lock",
+    "queue.py:get",
+    "thread.py:_worker",
+    "selectors.py:select",
+})
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    def __init__(self, max_stack_depth: int = 64):
+        self.max_stack_depth = max_stack_depth
+        self.interval = 0.01
+        self.include_idle = False
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started: Optional[float] = None
+        self.stopped: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms: float = 10.0, duration_s: Optional[float] = None, include_idle: bool = False):
+        """Start sampling (clearing earlier samples); stops by itself after duration_s if given"""
+        with self._lock:
+            if self.running:
+                return
+            self.interval = max(interval_ms, 1.0) / 1000
+            self.include_idle = include_idle
+            self.stacks = Counter()
+            self.samples = 0
+            self.started = time.time()
+            self.stopped = None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(duration_s,), name="rag-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            if self.stopped is None and self.started is not None:
+                self.stopped = time.time()
+
+    def _run(self, duration_s: Optional[float]):
+        own_id = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + duration_s if duration_s else None
+        while not self._stop.wait(self.interval):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            sample = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if not self.include_idle and _frame_name(frame) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_stack_depth:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                sample.append(";".join(reversed(stack)))
+            with self._lock:
+                self.stacks.update(sample)
+                self.samples += 1
+        with self._lock:
+            self.stopped = time.time()
+
+    def _snapshot(self) -> Counter:
+        with self._lock:
+            return self.stacks.copy()
+
+    def folded(self) -> str:
+        stacks = self._snapshot()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def top(self, limit: int = 30) -> List[Dict]:
+        """Functions by samples where they were running (self) and on the stack at all (total)"""
+        own, total = Counter(), Counter()
+        for stack, count in self._snapshot().items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        all_samples = sum(own.values()) or 1
+        return [
+            {"function": name, "self": count, "total": total[name], "self_pct": round(100 * count / all_samples, 1)}
+            for name, count in own.most_common(limit)
+        ]
+
+    def info(self) -> Dict:
+        end = self.stopped or time.time()
+        return {
+            "running": self.running,
+            "interval_ms": self.interval * 1000,
+            "include_idle": self.include_idle,
+            "samples": self.samples,
+            "seconds": round(end - self.started, 3) if self.started else 0.0,
+            "distinct_stacks": len(self.stacks),
+        }
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from queue import Empty, Queue
+from typing import Dict
+
+from metrics import BATCH_SIZE, current_trace, observe, traced
+
+
+class QueryBatcher:
+    """Collects concurrent searches and runs them as one encode + one index.search"""
+
+    def __init__(self, search_batch, max_batch: int = 32, window_ms: float = 5.0, workers: int = 1):
+        # search_batch(queries, ks) returns one result per query
+        self.search_batch = search_batch
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self.queue = Queue()
+        self._closed = False
+
+        # Metrics
+        self._stats_lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.queue_delays = deque(maxlen=10000)
+        self.total_queries = 0
+        self.total_batches = 0
+
+        # Threads start on first submit, so a preloading parent process can fork safely
+        self.workers = workers
+        self.threads = []
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self.threads:
+                return
+            self.threads = [
+                threading.Thread(target=self._run, name=f"rag-batcher-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for t in self.threads:
+                t.start()
+
+    def submit(self, query: str, k: int) -> Future:
+        """Queue a query; the future resolves to its search_batch result"""
+        if self._closed:
+            raise RuntimeError("QueryBatcher is closed")
+        if not self.threads:
+            self._ensure_started()
+        future = Future()
+        self.queue.put((query, k, time.perf_counter(), future, current_trace()))
+        return future
+
+    def _collect(self):
+        first = self.queue.get()
+        if first is None:
+            # Leave the shutdown marker for the other workers
+            self.queue.put(None)
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except Empty:
+                break
+            if item is None:
+                # Put the shutdown marker back for the next collect
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            started = time.perf_counter()
+            batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            with self._stats_lock:
+                self.batch_sizes[len(batch)] += 1
+                self.total_batches += 1
+                self.total_queries += len(batch)
+                self.queue_delays.extend(started - enqueued for _, _, enqueued, _, _ in batch)
+            BATCH_SIZE.observe(len(batch))
+            for _, _, enqueued, _, trace in batch:
+                observe("batch_queue", started - enqueued, trace)
+
+            queries = [query for query, _, _, _, _ in batch]
+            ks = [k for _, k, _, _, _ in batch]
+            try:
+                # Every query in the batch waited for the whole batch, so each trace gets its spans
+                with traced(trace for _, _, _, _, trace in batch):
+                    results = self.search_batch(queries, ks)
+            except Exception as e:
+                for _, _, _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, _, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self) -> Dict:
+        """Batch-size distribution and queueing delay percentiles (ms)"""
+        with self._stats_lock:
+            delays = sorted(self.queue_delays)
+            sizes = dict(sorted(self.batch_sizes.items()))
+            total_queries, total_batches = self.total_queries, self.total_batches
+
+        def pct(p):
+            if not delays:
+                return 0.0
+            return delays[min(len(delays) - 1, int(p / 100 * len(delays)))] * 1000
+
+        return {
+            "queries": total_queries,
+            "batches": total_batches,
+            "mean_batch_size": total_queries / total_batches if total_batches else 0.0,
+            "batch_size_histogram": sizes,
+            "queue_delay_ms": {"p50": pct(50), "p90": pct(90), "p99": pct(99), "max": pct(100)},
+            "pending": self.queue.qsize(),
+        }
+
+    def close(self):
+        self._closed = True
+        self.queue.put(None)
+        for t in self.threads:
+            t.join()
@@ -1,61 +1,407 @@
 from sentence_transformers import SentenceTransformer
-import faiss
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from query_batcher import QueryBatcher
+from index_backends import VectorIndex
+from segment_store import ReadOnlyStore, SegmentStore, content_hash
+from lexical_index import BM25Index, tokenize
+from metrics import span
+import asyncio
+import contextvars
+import functools
+import threading
 import json
 import os
 
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int, rrf_k: int = 60) -> List[int]:
+    """Merge ranked ID lists by sum of 1 / (rrf_k + rank); only ranks matter, not the scores"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])[:k]
+
 class RAGEngine:
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
-        self.index = None
-        self.documents = []
-        
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        search_workers: int = 4,
+        max_batch: int = 32,
+        batch_window_ms: float = 5.0,
+        batch_workers: int = 1,
+        index_type: str = "flat_ip",
+        index_params: Optional[Dict] = None,
+        snapshot_min_docs: int = 10000,
+        snapshot_max_tail: float = 0.25,
+        onnx_model_path: Optional[str] = None,
+        hybrid: bool = True,
+        fusion_candidates: int = 20,
+        rrf_k: int = 60,
+        reranker=None,
+    ):
+        # The model is loaded on first use (or by load_model), not at construction
+        self.model_name = model_name
+        self.onnx_model_path = onnx_model_path
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.index = VectorIndex(index_type, **(index_params or {}))
+        # BM25 over the same document IDs; hybrid search fuses its ranking with the vector one
+        self.lexical = BM25Index()
+        self.hybrid = hybrid
+        self.fusion_candidates = fusion_candidates
+        self.rrf_k = rrf_k
+        # Optional CrossEncoderReranker applied to the fused candidates
+        self.reranker = reranker
+        # Documents live in the segment store once saved; until then they are pending
+        self.store: Optional[SegmentStore] = None
+        # Documents [0, _committed) are in the store. Raised under _lock together with
+        # trimming pending_documents, so an ID never maps to the wrong document mid-save
+        self._committed = 0
+        self._num_documents = 0
+        self.pending_documents: List[str] = []
+        self.pending_vectors: List[np.ndarray] = []
+        # A new index snapshot is written once the documents after the last one reach
+        # snapshot_min_docs and snapshot_max_tail of the snapshotted corpus. Everything
+        # after it is re-added (and re-tokenized) on load, so this bounds restart work
+        # at about max_tail of the corpus, for snapshot writes that still grow geometrically
+        self.snapshot_min_docs = snapshot_min_docs
+        self.snapshot_max_tail = snapshot_max_tail
+        # Bounded pool for encode + FAISS work so it never runs on the event loop
+        self.executor = ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix="rag")
+        # FAISS allows concurrent searches but not a search racing an add
+        self._lock = threading.Lock()
+        # Saves commit the pending documents, so only one may run at a time
+        self._save_lock = threading.Lock()
+        # Content hashes of all documents, built on first use for deduplication
+        self._hashes = None
+        # Concurrent asearch calls are encoded together; max_batch <= 1 disables batching.
+        # Searches then run on the batcher's threads, not on the executor above
+        self.batcher = None
+        if max_batch > 1:
+            self.batcher = QueryBatcher(
+                self._search_batch, max_batch=max_batch, window_ms=batch_window_ms, workers=batch_workers
+            )
+
+    @property
+    def model(self):
+        if self._model is None:
+            self.load_model()
+        return self._model
+
+    @property
+    def model_loaded(self) -> bool:
+        return self._model is not None
+
+    def load_model(self):
+        """Load the embedding model (SentenceTransformer, or ONNX if onnx_model_path is set)"""
+        with self._model_lock:
+            if self._model is not None:
+                return
+            if self.onnx_model_path:
+                from embedding_onnx import OnnxEncoder
+                self._model = OnnxEncoder(self.onnx_model_path)
+            else:
+                self._model = SentenceTransformer(self.model_name)
+        if self.reranker is not None:
+            self.reranker.load()
+
+    def warmup(self, rounds: int = 3):
+        """Run encode and search once per batch shape so first requests don't pay for lazy init"""
+        queries = ["What is Urithiru?", "Who are the Knights Radiant?", "What is Stormlight?"]
+        max_batch = self.batcher.max_batch if self.batcher is not None else 1
+        for _ in range(rounds):
+            for size in sorted({1, min(8, max_batch), max_batch}):
+                batch = (queries * size)[:size]
+                if self.index.ntotal:
+                    self._search_batch(batch, [3] * size)
+                else:
+                    self.model.encode(batch, batch_size=size)
+
+    @property
+    def num_documents(self) -> int:
+        # One int, so it is read without the lock (which an IVF train can hold for long)
+        return self._num_documents
+
+    def get_document(self, doc_id: int) -> str:
+        """Look up a document by its stable ID (call with _lock held)"""
+        if doc_id < self._committed:
+            return self.store.get(doc_id)
+        return self.pending_documents[doc_id - self._committed]
+
     def add_documents(self, documents: List[str]):
         """Add documents to the RAG system"""
-        self.documents.extend(documents)
-        embeddings = self.model.encode(documents)
-        
-        # Initialize FAISS index if not exists
-        if self.index is None:
-            self.index = faiss.IndexFlatL2(embeddings.shape[1])
-        
-        # Add embeddings to index
-        self.index.add(np.array(embeddings).astype('float32'))
-    
+        with span("encode_documents"):
+            embeddings = self.model.encode(documents)
+        self.add_embeddings(documents, embeddings)
+
+    def add_embeddings(self, documents: List[str], embeddings):
+        """Add documents whose embeddings were computed elsewhere"""
+        embeddings = np.asarray(embeddings, dtype="float32")
+        tokens = [tokenize(doc) for doc in documents]
+
+        with self._lock, span("index_add"):
+            # First, so that if it fails (e.g. training an IVF index) nothing else has changed
+            self.index.add(embeddings)
+            for doc_tokens in tokens:
+                self.lexical.add_tokens(doc_tokens)
+            self.pending_documents.extend(documents)
+            self._num_documents += len(documents)
+            self.pending_vectors.append(embeddings)
+            if self._hashes is not None:
+                self._hashes.update(content_hash(doc) for doc in documents)
+
+    def known_hashes(self) -> set:
+        """Content hashes of every document, see segment_store.content_hash"""
+        with self._lock:
+            if self._hashes is None:
+                hashes = self.store.hashes() if self.store is not None else set()
+                hashes.update(content_hash(doc) for doc in self.pending_documents)
+                self._hashes = hashes
+            return self._hashes
+
     def search(self, query: str, k: int = 3) -> List[str]:
         """Search for relevant documents"""
-        if not self.index:
-            return []
-            
-        # Encode query
-        query_embedding = self.model.encode([query])
-        
-        # Search in FAISS
-        distances, indices = self.index.search(
-            np.array(query_embedding).astype('float32'), k
-        )
-        
-        # Return relevant documents
-        return [self.documents[i] for i in indices[0]]
-    
+        return self.search_many([query], k)[0]
+
+    def search_many(self, queries: List[str], k: int = 3) -> List[List[str]]:
+        """Search for several queries with one encode and one FAISS call"""
+        return [docs for docs, _ in self._search_batch(queries, [k] * len(queries))]
+
+    def _search_batch(self, queries: List[str], ks: List[int]) -> List[Tuple[List[str], np.ndarray]]:
+        """Per query: its top-k documents and its embedding"""
+        if self.index.ntotal == 0:
+            return [([], None) for _ in queries]
+
+        # Encode queries
+        with span("encode"):
+            query_embeddings = self.model.encode(queries, batch_size=max(len(queries), 1))
+
+        # With fusion or reranking, gather more candidates than we return
+        n = max(ks)
+        if self.hybrid:
+            n = max(n, self.fusion_candidates)
+        if self.reranker is not None:
+            n = max(n, self.reranker.max_candidates)
+        wanted = [max(k, self.reranker.max_candidates) if self.reranker is not None else k for k in ks]
+
+        # Search in FAISS (and BM25)
+        with self._lock:
+            with span("vector_search"):
+                distances, indices = self.index.search(query_embeddings, n)
+            # FAISS pads with -1 when there are fewer than n
+            rankings = [[[int(i) for i in row if i >= 0]] for row in indices]
+            if self.hybrid:
+                with span("lexical_search"):
+                    for query, ranking in zip(queries, rankings):
+                        ranking.append(self.lexical.search(query, n)[0].tolist())
+
+            with span("fusion"):
+                candidates = []
+                for ranking, want in zip(rankings, wanted):
+                    ids = reciprocal_rank_fusion(ranking, want, self.rrf_k) if self.hybrid else ranking[0]
+                    candidates.append([self.get_document(i) for i in ids[:want]])
+
+        # The cross-encoder is the slow part; run it outside the lock
+        if self.reranker is not None:
+            with span("rerank"):
+                candidates = self.reranker.rerank_many(queries, candidates)
+        return [(docs[:k], embedding) for docs, k, embedding in zip(candidates, ks, query_embeddings)]
+
+    async def asearch(self, query: str, k: int = 3) -> List[str]:
+        """Search without blocking the event loop"""
+        docs, _ = await self.asearch_with_embedding(query, k)
+        return docs
+
+    async def asearch_with_embedding(self, query: str, k: int = 3) -> Tuple[List[str], Optional[np.ndarray]]:
+        """Like asearch, but also returns the query embedding (None if the index is empty)"""
+        if self.batcher is not None:
+            return await asyncio.wrap_future(self.batcher.submit(query, k))
+        loop = asyncio.get_running_loop()
+        # copy_context keeps the request's trace in the worker thread
+        ctx = contextvars.copy_context()
+        results = await loop.run_in_executor(self.executor, ctx.run, self._search_batch, [query], [k])
+        return results[0]
+
+    def set_search_params(
+        self,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        hybrid: Optional[bool] = None,
+        fusion_candidates: Optional[int] = None,
+        rerank_max_candidates: Optional[int] = None,
+        rerank_max_ms: Optional[float] = None,
+    ):
+        """Tune IVF nprobe / HNSW efSearch, fusion and the rerank budget at runtime"""
+        with self._lock:
+            self.index.set_search_params(nprobe=nprobe, ef_search=ef_search)
+            if hybrid is not None:
+                self.hybrid = hybrid
+            if fusion_candidates is not None:
+                self.fusion_candidates = fusion_candidates
+            if self.reranker is not None:
+                self.reranker.set_budget(max_candidates=rerank_max_candidates, max_ms=rerank_max_ms)
+
+    def search_info(self) -> Dict:
+        return {
+            "hybrid": self.hybrid,
+            "fusion_candidates": self.fusion_candidates,
+            "rrf_k": self.rrf_k,
+            "lexical": self.lexical.info(),
+            "rerank": self.reranker.info() if self.reranker is not None else None,
+        }
+
+    async def aadd_documents(self, documents: List[str]):
+        """Add documents without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        await loop.run_in_executor(self.executor, ctx.run, self.add_documents, documents)
+
+    async def aset_search_params(self, **params):
+        """set_search_params without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, functools.partial(self.set_search_params, **params))
+
+    async def asave(self, path: str):
+        """Save without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        await loop.run_in_executor(self.executor, ctx.run, self.save, path)
+
+    def close(self):
+        """Stop background workers"""
+        if self.batcher is not None:
+            self.batcher.close()
+        if self.store is not None:
+            self.store.close()
+        self.executor.shutdown(wait=True)
+
+    def _open_store(self, path: str):
+        store = SegmentStore.open(path, index_meta=self.index.meta())
+        try:
+            store.acquire_writer()
+        except ReadOnlyStore:
+            store.close()
+            raise
+        if store.count:
+            raise ValueError(f"{path} already holds a different knowledge base")
+        if self.store is not None and self.store.count:
+            # Moving to a new location: carry the committed documents over as the first segment
+            documents = list(self.store.iter_documents())
+            vectors = np.concatenate(list(self.store.iter_vectors()))
+            store.append(documents, vectors)
+            self.store.close()
+        with self._lock:
+            self.store = store
+
+    def acquire_writer(self, path: str):
+        """Make this process the writer of the store at path; raises ReadOnlyStore if another one is"""
+        with self._save_lock:
+            if self.store is None or os.path.abspath(self.store.path) != os.path.abspath(path):
+                self._open_store(path)
+            else:
+                self.store.acquire_writer()
+
+    async def aacquire_writer(self, path: str):
+        """acquire_writer without blocking the event loop (it waits for a running save)"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.acquire_writer, path)
+
     def save(self, path: str):
-        """Save the RAG system to disk"""
-        if not os.path.exists(path):
-            os.makedirs(path)
-            
-        # Save documents
-        with open(os.path.join(path, "documents.json"), "w") as f:
-            json.dump(self.documents, f)
-            
-        # Save FAISS index
-        faiss.write_index(self.index, os.path.join(path, "index.faiss"))
-    
+        """Commit documents added since the last save as a new segment"""
+        with self._save_lock, span("save"):
+            self._save(path)
+
+    def _save(self, path: str):
+        if self.store is None or os.path.abspath(self.store.path) != os.path.abspath(path):
+            self._open_store(path)
+
+        with self._lock:
+            documents = list(self.pending_documents)
+            vectors = list(self.pending_vectors)
+        if documents:
+            self.store.append(documents, np.concatenate(vectors))
+            with self._lock:
+                # Anything added while we were writing stays pending
+                del self.pending_documents[:len(documents)]
+                del self.pending_vectors[:len(vectors)]
+                self._committed += len(documents)
+
+        self._maybe_snapshot()
+        self.store.maybe_compact()
+
+    def _maybe_snapshot(self):
+        # Copying the indexes holds _lock, so never start another while one is being written
+        if not self.store.writable or self.store.snapshot_pending is not None:
+            return
+        covered = self.store.snapshot["ntotal"] if self.store.snapshot else 0
+        if self._committed - covered < max(self.snapshot_min_docs, int(covered * self.snapshot_max_tail)):
+            return
+        with self._lock:
+            # Only snapshot an index that matches the committed documents exactly
+            if self.pending_documents:
+                return
+            snapshot = self.index.copy()
+            lexical = self.lexical.copy()
+            ntotal = self._committed
+        self.store.schedule_snapshot(snapshot, ntotal, lexical)
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        """Whether anything was saved at path, as segments or in the legacy layout"""
+        return SegmentStore.exists(path) or os.path.exists(os.path.join(path, "documents.json"))
+
     def load(self, path: str):
         """Load the RAG system from disk"""
+        if not SegmentStore.exists(path):
+            self._load_legacy(path)
+            return
+
+        store = SegmentStore.open(path)
+        if store.snapshot_path:
+            index = VectorIndex.load(store.snapshot_path)
+        else:
+            index = VectorIndex.from_meta(store.index_meta)
+        # Catch up on segments committed after the snapshot (vectors are memory-mapped)
+        for vectors in store.iter_vectors(start=index.ntotal):
+            index.add(vectors)
+        # Snapshots from before the lexical index have none; it is then rebuilt from all documents
+        if BM25Index.exists(store.snapshot_path):
+            lexical = BM25Index.load(store.snapshot_path)
+        else:
+            lexical = BM25Index()
+        lexical.add(store.iter_documents(start=lexical.num_documents))
+
+        with self._lock:
+            self.store = store
+            self._committed = store.count
+            self._num_documents = store.count
+            self.index = index
+            self.lexical = lexical
+            self.pending_documents = []
+            self.pending_vectors = []
+            self._hashes = None
+
+    def _load_legacy(self, path: str):
+        """Load a documents.json + index.faiss pair; the next save migrates it to segments"""
         # Load documents
         with open(os.path.join(path, "documents.json"), "r") as f:
-            self.documents = json.load(f)
-            
+            documents = json.load(f)
+
         # Load FAISS index
-        self.index = faiss.read_index(os.path.join(path, "index.faiss")) 
\ No newline at end of file
+        index = VectorIndex.load(path)
+        vectors = index.reconstruct_all()
+        if vectors is None:
+            vectors = np.asarray(self.model.encode(documents), dtype="float32")
+        lexical = BM25Index()
+        lexical.add(documents)
+
+        with self._lock:
+            self.index = index
+            self.lexical = lexical
+            self.pending_documents = documents
+            self.pending_vectors = [vectors]
+            self._committed = 0
+            self._num_documents = len(documents)
+            self._hashes = None
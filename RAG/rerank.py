@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class CrossEncoderReranker:
+    """Reorders fused candidates with a small CPU cross-encoder, within a time and candidate budget.
+
+    Pairs are scored rank by rank across all queries of a batch (every query's
+    first candidate, then every query's second, ...), so when the time budget
+    runs out each query has its best candidates scored. Scored candidates are
+    sorted by the cross-encoder; the rest keep their fused order behind them.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        max_candidates: int = 20,
+        max_ms: float = 50.0,
+        batch_size: int = 16,
+    ):
+        self.model_name = model_name
+        self.max_candidates = max_candidates
+        self.max_ms = max_ms
+        self.batch_size = batch_size
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.calls = 0
+        self.pairs_scored = 0
+        self.budget_exhausted = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["CrossEncoderReranker"]:
+        """None unless RAG_RERANK_MODEL is set"""
+        model_name = os.getenv("RAG_RERANK_MODEL")
+        if not model_name:
+            return None
+        return cls(
+            model_name=model_name,
+            max_candidates=int(os.getenv("RAG_RERANK_MAX_CANDIDATES", "20")),
+            max_ms=float(os.getenv("RAG_RERANK_MAX_MS", "50")),
+        )
+
+    def load(self):
+        with self._model_lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+                self._model = CrossEncoder(self.model_name, max_length=256)
+
+    @property
+    def model(self):
+        if self._model is None:
+            self.load()
+        return self._model
+
+    def rerank_many(self, queries: List[str], candidates: List[List[str]]) -> List[List[str]]:
+        """Rerank each query's candidate documents"""
+        deadline = time.perf_counter() + self.max_ms / 1000
+        limits = [min(len(docs), self.max_candidates) for docs in candidates]
+        # Interleave by rank so a cut-off budget still covers the top of every list
+        pairs = [
+            (qi, rank)
+            for rank in range(max(limits, default=0))
+            for qi in range(len(queries))
+            if rank < limits[qi]
+        ]
+        scores: List[Dict[int, float]] = [{} for _ in queries]
+        done = 0
+        while done < len(pairs):
+            # Always score at least one batch, even when the budget is tiny
+            if done and time.perf_counter() >= deadline:
+                self.budget_exhausted += 1
+                break
+            chunk = pairs[done:done + self.batch_size]
+            predicted = self.model.predict(
+                [(queries[qi], candidates[qi][rank]) for qi, rank in chunk],
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+            )
+            for (qi, rank), score in zip(chunk, np.asarray(predicted).reshape(-1)):
+                scores[qi][rank] = float(score)
+            done += len(chunk)
+
+        self.calls += 1
+        self.pairs_scored += done
+        results = []
+        for docs, scored in zip(candidates, scores):
+            ranked = sorted(scored, key=lambda rank: -scored[rank])
+            results.append([docs[rank] for rank in ranked] + [d for rank, d in enumerate(docs) if rank not in scored])
+        return results
+
+    def set_budget(self, max_candidates: Optional[int] = None, max_ms: Optional[float] = None):
+        if max_candidates is not None:
+            self.max_candidates = max_candidates
+        if max_ms is not None:
+            self.max_ms = max_ms
+
+    def info(self) -> Dict:
+        return {
+            "model": self.model_name,
+            "max_candidates": self.max_candidates,
+            "max_ms": self.max_ms,
+            "calls": self.calls,
+            "pairs_scored": self.pairs_scored,
+            "budget_exhausted": self.budget_exhausted,
+        }
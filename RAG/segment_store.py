@@ -0,0 +1,514 @@
+"""Append-only, segment-based storage for RAG documents and their embeddings.
+
+Layout of a data directory:
+
+    MANIFEST                   write-ahead log of JSON records, one per line
+    LOCK                       held (exclusively) by the one process that writes the store
+    segments/seg-00000001/     immutable segment
+        vectors.npy            float32 (n, dim) embeddings, memory-mapped on load
+        offsets.npy            int64 (n + 1) byte offsets into docs.bin
+        docs.bin               UTF-8 document texts, back to back
+        hashes.npy             uint64 content hashes, for deduplication
+    snapshots/snap-00000007/   VectorIndex.save() + BM25Index.save() output covering the first ntotal docs
+
+A segment is written to a temporary directory, fsynced and renamed into place,
+and only becomes part of the store once its record is appended (and fsynced) to
+MANIFEST. A crash at any point therefore leaves either the old or the new state;
+directories not referenced by the manifest are removed on the next open.
+
+Only one process may write a store. The first write takes an exclusive lock on
+LOCK and keeps it until close(); other processes can still open and read the
+store, but their writes raise ReadOnlyStore.
+
+Document IDs are global and sequential: a segment holds IDs
+[first_id, first_id + count) and compaction only merges adjacent segments, so
+an ID never changes.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+MANIFEST = "MANIFEST"
+WRITER_LOCK = "LOCK"
+
+logger = logging.getLogger("rag.segment_store")
+
+
+def content_hash(text: str) -> int:
+    """64-bit hash of a document with case and whitespace normalized"""
+    normalized = " ".join(text.lower().split())
+    return int.from_bytes(hashlib.sha1(normalized.encode("utf-8")).digest()[:8], "little")
+
+
+def _fsync_dir(path: str):
+    # Makes renames durable on POSIX; directories can't be opened this way on Windows
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# Stores this process writes, by real path. POSIX locks are per process, so a second
+# SegmentStore on the same path would otherwise get the lock too (and drop it on close)
+_writers: Dict[str, int] = {}
+_writers_lock = threading.Lock()
+
+
+class ReadOnlyStore(RuntimeError):
+    """Another process writes this store, or it changed on disk since it was opened"""
+
+
+def _try_lock(fd: int) -> bool:
+    # POSIX record locks are not inherited by forked children, unlike flock locks
+    try:
+        if fcntl is not None:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _remove_tree(path: str):
+    # Memory-mapped files can't be deleted on Windows; they get retried on the next open
+    shutil.rmtree(path, ignore_errors=True)
+
+
+class Segment:
+    def __init__(self, path: str, first_id: int, count: int):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.first_id = first_id
+        self.count = count
+        self._vectors = None
+        self._offsets = None
+        self._blob = None
+        self._hashes = None
+
+    @property
+    def vectors(self) -> np.ndarray:
+        if self._vectors is None:
+            self._vectors = np.load(os.path.join(self.path, "vectors.npy"), mmap_mode="r")
+        return self._vectors
+
+    @property
+    def offsets(self) -> np.ndarray:
+        if self._offsets is None:
+            self._offsets = np.load(os.path.join(self.path, "offsets.npy"), mmap_mode="r")
+        return self._offsets
+
+    @property
+    def blob(self):
+        if self._blob is None:
+            blob_path = os.path.join(self.path, "docs.bin")
+            if os.path.getsize(blob_path):
+                self._blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+            else:
+                self._blob = np.zeros(0, dtype=np.uint8)
+        return self._blob
+
+    @property
+    def hashes(self) -> np.ndarray:
+        if self._hashes is None:
+            hashes_path = os.path.join(self.path, "hashes.npy")
+            if os.path.exists(hashes_path):
+                self._hashes = np.load(hashes_path, mmap_mode="r")
+            else:
+                self._hashes = np.array([content_hash(doc) for doc in self.documents()], dtype=np.uint64)
+        return self._hashes
+
+    def get(self, local_id: int) -> str:
+        start, stop = int(self.offsets[local_id]), int(self.offsets[local_id + 1])
+        return self.blob[start:stop].tobytes().decode("utf-8")
+
+    def documents(self) -> Iterator[str]:
+        for i in range(self.count):
+            yield self.get(i)
+
+    def open_files(self):
+        """Map every file now, so the segment stays readable after its directory is removed"""
+        self.vectors, self.offsets, self.blob, self.hashes
+
+    @staticmethod
+    def write(path: str, documents: List[str], vectors: np.ndarray):
+        """Write a segment to path atomically (via a temporary sibling directory)"""
+        tmp = os.path.join(os.path.dirname(path), f".tmp-{os.path.basename(path)}")
+        _remove_tree(tmp)
+        os.makedirs(tmp)
+
+        encoded = [doc.encode("utf-8") for doc in documents]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        hashes = np.array([content_hash(doc) for doc in documents], dtype=np.uint64)
+
+        with open(os.path.join(tmp, "docs.bin"), "wb") as f:
+            for b in encoded:
+                f.write(b)
+            f.flush()
+            os.fsync(f.fileno())
+        arrays = (("offsets.npy", offsets), ("hashes.npy", hashes), ("vectors.npy", np.asarray(vectors, dtype="float32")))
+        for name, array in arrays:
+            with open(os.path.join(tmp, name), "wb") as f:
+                np.save(f, array)
+                f.flush()
+                os.fsync(f.fileno())
+
+        os.replace(tmp, path)
+        _fsync_dir(os.path.dirname(path))
+
+
+class SegmentStore:
+    def __init__(self, path: str, max_segments: int = 8, merge_factor: int = 4):
+        self.path = path
+        self.max_segments = max_segments
+        self.merge_factor = merge_factor
+        self.segments: List[Segment] = []
+        self.index_meta: Dict = {}
+        self.snapshot: Optional[Dict] = None
+        self._seq = 0
+        self._lock = threading.Lock()
+        # Compaction and snapshots run one at a time, off the request path
+        self._background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-compact")
+        self._compacting = False
+        # ntotal of a snapshot that is scheduled or being written
+        self.snapshot_pending: Optional[int] = None
+        # Writer lock, held by the process (pid) that opened it
+        self._writer_fd: Optional[int] = None
+        self._writer_pid: Optional[int] = None
+        # MANIFEST as we last read or wrote it, and whether it ended in a torn record
+        self._manifest_seen = None
+        self._torn = False
+
+    # ---- opening -------------------------------------------------------
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, MANIFEST))
+
+    @classmethod
+    def open(cls, path: str, index_meta: Optional[Dict] = None, **kwargs) -> "SegmentStore":
+        """Open the store at path, creating it (with index_meta) if it doesn't exist"""
+        store = cls(path, **kwargs)
+        os.makedirs(os.path.join(path, "segments"), exist_ok=True)
+        os.makedirs(os.path.join(path, "snapshots"), exist_ok=True)
+        # Repairs are writes: only done when no other process is writing. The lock is not
+        # kept, so a process that opens the store and then forks leaves writing to a child
+        writer = store._lock_writer()
+        try:
+            if cls.exists(path):
+                # Taken first: a commit racing the replay then makes the store look stale, not current
+                store._manifest_seen = store._manifest_state()
+                store._torn = not store._replay()
+            elif writer:
+                store.index_meta = index_meta or {}
+                store._rewrite_manifest()
+            else:
+                raise ReadOnlyStore(f"{path} is being created by another process")
+            if writer:
+                store._repair()
+        finally:
+            if writer:
+                store._unlock_writer()
+        return store
+
+    def _replay(self) -> bool:
+        """Rebuild state from MANIFEST; returns False if the log ended in a torn record"""
+        segments: Dict[str, Dict] = {}
+        clean = True
+        with open(os.path.join(self.path, MANIFEST), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn write of the last record: it never committed
+                    clean = False
+                    break
+                if not line.endswith("\n"):
+                    clean = False
+                self._seq = max(self._seq, record.get("seq", 0))
+                op = record["op"]
+                if op == "init":
+                    self.index_meta = record["index"]
+                elif op == "add":
+                    segments[record["segment"]] = record
+                elif op == "merge":
+                    for name in record["replaces"]:
+                        segments.pop(name, None)
+                    segments[record["segment"]] = record
+                elif op == "snapshot":
+                    self.snapshot = record
+        self.segments = sorted(
+            (Segment(self._segment_path(name), r["first_id"], r["count"]) for name, r in segments.items()),
+            key=lambda s: s.first_id,
+        )
+        return clean
+
+    def _repair(self):
+        """Drop a torn MANIFEST record and uncommitted directories (call as the writer)"""
+        if self._torn:
+            # So new appends start on a clean line
+            self._rewrite_manifest()
+            self._torn = False
+        self._remove_orphans()
+
+    def _remove_orphans(self):
+        live = {s.name for s in self.segments}
+        for name in os.listdir(os.path.join(self.path, "segments")):
+            if name not in live:
+                _remove_tree(os.path.join(self.path, "segments", name))
+        live_snapshot = self.snapshot["dir"] if self.snapshot else None
+        for name in os.listdir(os.path.join(self.path, "snapshots")):
+            if name != live_snapshot:
+                _remove_tree(os.path.join(self.path, "snapshots", name))
+
+    # ---- writer lock ---------------------------------------------------
+
+    def _lock_writer(self) -> bool:
+        key = os.path.realpath(self.path)
+        with _writers_lock:
+            if _writers.get(key) == os.getpid():
+                return False
+            fd = os.open(os.path.join(self.path, WRITER_LOCK), os.O_RDWR | os.O_CREAT)
+            if not _try_lock(fd):
+                os.close(fd)
+                return False
+            _writers[key] = os.getpid()
+        self._writer_fd, self._writer_pid = fd, os.getpid()
+        return True
+
+    def _unlock_writer(self):
+        if self._writer_fd is not None and self._writer_pid == os.getpid():
+            with _writers_lock:
+                _writers.pop(os.path.realpath(self.path), None)
+                # Closing the descriptor releases the lock
+                os.close(self._writer_fd)
+        self._writer_fd = self._writer_pid = None
+
+    @property
+    def writable(self) -> bool:
+        return self._writer_pid == os.getpid()
+
+    def acquire_writer(self):
+        """Become the store's only writer, until close(); raises ReadOnlyStore if that isn't possible"""
+        with self._lock:
+            if self.writable:
+                return
+            if not self._lock_writer():
+                raise ReadOnlyStore(f"{self.path} is being written by another process")
+            if self._manifest_state() != self._manifest_seen:
+                # Someone else committed since we read MANIFEST, so our view (and the engine's) is stale
+                self._unlock_writer()
+                raise ReadOnlyStore(f"{self.path} changed on disk since it was opened")
+            self._repair()
+
+    def _manifest_state(self):
+        st = os.stat(os.path.join(self.path, MANIFEST))
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    # ---- manifest ------------------------------------------------------
+
+    def _next_seq(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    def _segment_path(self, name: str) -> str:
+        return os.path.join(self.path, "segments", name)
+
+    def _append_record(self, record: Dict):
+        with open(os.path.join(self.path, MANIFEST), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._manifest_seen = self._manifest_state()
+
+    def _rewrite_manifest(self):
+        """Replace the log with the minimal set of records describing the current state"""
+        records = [{"seq": self._seq, "op": "init", "index": self.index_meta}]
+        records += [
+            {"seq": self._seq, "op": "add", "segment": s.name, "first_id": s.first_id, "count": s.count}
+            for s in self.segments
+        ]
+        if self.snapshot:
+            records.append(self.snapshot)
+        tmp = os.path.join(self.path, MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, MANIFEST))
+        _fsync_dir(self.path)
+        self._manifest_seen = self._manifest_state()
+
+    # ---- reads ---------------------------------------------------------
+
+    @property
+    def count(self) -> int:
+        segments = self.segments
+        return segments[-1].first_id + segments[-1].count if segments else 0
+
+    def _find(self, doc_id: int) -> Segment:
+        segments = self.segments
+        pos = bisect.bisect_right([s.first_id for s in segments], doc_id) - 1
+        if pos < 0 or doc_id >= segments[pos].first_id + segments[pos].count:
+            raise IndexError(f"document id {doc_id} out of range")
+        return segments[pos]
+
+    def get(self, doc_id: int) -> str:
+        segment = self._find(doc_id)
+        return segment.get(doc_id - segment.first_id)
+
+    def iter_vectors(self, start: int = 0) -> Iterator[np.ndarray]:
+        """Yield the embeddings of documents [start, count) one segment at a time"""
+        for segment in list(self.segments):
+            stop = segment.first_id + segment.count
+            if stop <= start:
+                continue
+            yield segment.vectors[max(0, start - segment.first_id):]
+
+    def hashes(self) -> set:
+        """Content hashes of every stored document"""
+        return {int(h) for segment in list(self.segments) for h in segment.hashes}
+
+    def iter_documents(self, start: int = 0) -> Iterator[str]:
+        for segment in list(self.segments):
+            for local_id in range(max(0, start - segment.first_id), segment.count):
+                yield segment.get(local_id)
+
+    # ---- writes --------------------------------------------------------
+
+    def append(self, documents: List[str], vectors: np.ndarray) -> int:
+        """Commit a new segment; returns the ID of its first document"""
+        if not documents:
+            return self.count
+        self.acquire_writer()
+        with self._lock:
+            seq = self._next_seq()
+            name = f"seg-{seq:08d}"
+            first_id = self.count
+            Segment.write(self._segment_path(name), documents, vectors)
+            self._append_record({"seq": seq, "op": "add", "segment": name,
+                                 "first_id": first_id, "count": len(documents)})
+            self.segments = self.segments + [Segment(self._segment_path(name), first_id, len(documents))]
+        return first_id
+
+    def write_snapshot(self, vector_index, ntotal: int, lexical_index=None):
+        """Persist a VectorIndex (and BM25Index) covering documents [0, ntotal)"""
+        self.acquire_writer()
+        with self._lock:
+            seq = self._next_seq()
+        name = f"snap-{seq:08d}"
+        final = os.path.join(self.path, "snapshots", name)
+        tmp = os.path.join(self.path, "snapshots", f".tmp-{name}")
+        _remove_tree(tmp)
+        os.makedirs(tmp)
+        vector_index.save(tmp)
+        if lexical_index is not None:
+            lexical_index.save(tmp)
+        os.replace(tmp, final)
+        _fsync_dir(os.path.dirname(final))
+
+        with self._lock:
+            old = self.snapshot
+            self.snapshot = {"seq": seq, "op": "snapshot", "dir": name, "ntotal": ntotal}
+            self._append_record(self.snapshot)
+        if old:
+            _remove_tree(os.path.join(self.path, "snapshots", old["dir"]))
+
+    def schedule_snapshot(self, vector_index, ntotal: int, lexical_index=None):
+        with self._lock:
+            self.snapshot_pending = ntotal
+        self._submit(self._write_pending_snapshot, vector_index, ntotal, lexical_index)
+
+    def _write_pending_snapshot(self, vector_index, ntotal: int, lexical_index):
+        try:
+            self.write_snapshot(vector_index, ntotal, lexical_index)
+        finally:
+            with self._lock:
+                self.snapshot_pending = None
+
+    def _submit(self, fn, *args):
+        """Run fn on the background thread; nobody waits on it, so failures are logged here"""
+        def report(future):
+            if not future.cancelled() and future.exception() is not None:
+                logger.error("%s failed in %s", fn.__name__, self.path, exc_info=future.exception())
+        self._background.submit(fn, *args).add_done_callback(report)
+
+    @property
+    def snapshot_path(self) -> Optional[str]:
+        return os.path.join(self.path, "snapshots", self.snapshot["dir"]) if self.snapshot else None
+
+    # ---- compaction ----------------------------------------------------
+
+    def maybe_compact(self):
+        """Merge small segments in the background once there are too many"""
+        with self._lock:
+            if not self.writable or self._compacting or len(self.segments) <= self.max_segments:
+                return
+            self._compacting = True
+        self._submit(self._compact)
+
+    def _pick_merge(self, segments: List[Segment]) -> List[Segment]:
+        # Adjacent run with the fewest documents, so each document is rewritten O(log n) times
+        width = min(self.merge_factor, len(segments))
+        best = min(range(len(segments) - width + 1),
+                   key=lambda i: sum(s.count for s in segments[i:i + width]))
+        return segments[best:best + width]
+
+    def _compact(self):
+        try:
+            while len(self.segments) > self.max_segments:
+                victims = self._pick_merge(list(self.segments))
+                documents = [doc for s in victims for doc in s.documents()]
+                vectors = np.concatenate([s.vectors for s in victims])
+
+                with self._lock:
+                    seq = self._next_seq()
+                name = f"seg-{seq:08d}"
+                Segment.write(self._segment_path(name), documents, vectors)
+                merged = Segment(self._segment_path(name), victims[0].first_id, len(documents))
+                # Readers may still hold the old segment list; open the files they would read
+                # before the directories go (on POSIX an open mapping outlives the unlink; where
+                # removal fails, Windows, the next open() deletes the leftovers)
+                for s in victims:
+                    s.open_files()
+
+                with self._lock:
+                    self._append_record({"seq": seq, "op": "merge", "segment": name,
+                                         "first_id": merged.first_id, "count": merged.count,
+                                         "replaces": [s.name for s in victims]})
+                    names = {s.name for s in victims}
+                    kept = [s for s in self.segments if s.name not in names]
+                    self.segments = sorted(kept + [merged], key=lambda s: s.first_id)
+                    self._rewrite_manifest()
+                for s in victims:
+                    _remove_tree(s.path)
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def close(self):
+        self._background.shutdown(wait=True)
+        with self._lock:
+            self._unlock_writer()
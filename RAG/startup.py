@@ -0,0 +1,98 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger("rag.startup")
+
+# starting -> loading_model -> loading_index -> warming_up -> ready, or failed from any step
+STATES = ("starting", "loading_model", "loading_index", "warming_up", "ready", "failed")
+
+
+class Startup:
+    """Loads the embedding model and the index for a RAGEngine and reports progress.
+
+    preload() runs in the parent process before workers fork, so the model weights
+    and the memory-mapped segments are shared copy-on-write between them. Warmup
+    always runs in the worker: thread pools (torch, onnxruntime, the batcher) do
+    not survive a fork.
+    """
+
+    def __init__(self, rag, data_path: str, warmup: bool = True):
+        self.rag = rag
+        self.data_path = data_path
+        self.do_warmup = warmup
+        self.state = "starting"
+        self.error: Optional[str] = None
+        self.started = time.time()
+        self.timings: Dict[str, float] = {}
+        self.preloaded = False
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def _step(self, state: str, fn):
+        self.state = state
+        t0 = time.perf_counter()
+        fn()
+        self.timings[state] = round(time.perf_counter() - t0, 3)
+
+    def _load_index(self):
+        if not self.rag.exists(self.data_path):
+            # Nothing saved yet: start with an empty knowledge base
+            logger.info("No RAG data at %s, starting empty", self.data_path)
+            return
+        # Anything missing or unreadable past this point is a broken knowledge base, not an empty one
+        self.rag.load(self.data_path)
+
+    def _fail(self, e: Exception):
+        logger.exception("RAG startup failed during %s", self.state)
+        self.error = f"{self.state}: {type(e).__name__}: {e}"
+        self.state = "failed"
+
+    def preload(self):
+        """Load model and index in this process (call before forking workers)"""
+        try:
+            # onnxruntime starts its thread pool when the session is created, so an
+            # ONNX model is loaded after the fork instead
+            if not self.rag.onnx_model_path:
+                self._step("loading_model", self.rag.load_model)
+            self._step("loading_index", self._load_index)
+            self.preloaded = True
+        except Exception as e:
+            self._fail(e)
+            raise
+
+    def run(self):
+        """Load whatever preload() did not, then warm up"""
+        try:
+            if not self.rag.model_loaded:
+                self._step("loading_model", self.rag.load_model)
+            if not self.preloaded:
+                self._step("loading_index", self._load_index)
+            if self.do_warmup:
+                self._step("warming_up", self.rag.warmup)
+            self.state = "ready"
+            self.timings["total"] = round(time.time() - self.started, 3)
+            logger.info("RAG ready in %.2fs %s", self.timings["total"], self.timings)
+        except Exception as e:
+            self._fail(e)
+
+    def start(self):
+        """Run startup on a background thread so the server answers liveness probes meanwhile"""
+        self.thread = threading.Thread(target=self.run, name="rag-startup", daemon=True)
+        self.thread.start()
+
+    def info(self) -> Dict:
+        return {
+            "state": self.state,
+            "error": self.error,
+            "preloaded": self.preloaded,
+            "pid": os.getpid(),
+            "uptime_s": round(time.time() - self.started, 3),
+            "timings_s": self.timings,
+            "documents": self.rag.num_documents if self.state == "ready" else None,
+        }
@@ -0,0 +1,40 @@
+import json
+from typing import AsyncIterator, Dict
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+# sse: Server-Sent Events (EventSource-compatible); ndjson: one JSON object per line
+STREAM_FORMATS = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def format_event(event: Dict, fmt: str) -> str:
+    data = json.dumps(event, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {event['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+def stream_events(events: AsyncIterator[Dict], fmt: str) -> StreamingResponse:
+    """Stream answer events to the client.
+
+    Starlette awaits each send, so a slow reader pauses the generator (and with it
+    the upstream LLM read); a disconnect cancels the generator, and the LLM client
+    closes its upstream request in its finally block.
+    """
+    if fmt not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {sorted(STREAM_FORMATS)}")
+
+    async def body():
+        async for event in events:
+            yield format_event(event, fmt)
+
+    return StreamingResponse(
+        body(),
+        media_type=STREAM_FORMATS[fmt],
+        # Stop proxies (nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
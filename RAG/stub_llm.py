@@ -0,0 +1,99 @@
+"""Local stand-in for the OpenAI chat completions API, used by the load tests.
+
+Run with:  uvicorn stub_llm:app --port 9000
+and point the API at it with OPENAI_BASE_URL=http://127.0.0.1:9000/v1
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.requests import ClientDisconnect
+
+# Simulated model latency (GPT-4 round trips are in the seconds range).
+# When streaming, DELAY_MS is the time to the first token and TOKEN_MS the gap between tokens.
+DELAY_MS = float(os.getenv("STUB_LLM_DELAY_MS", "800"))
+JITTER_MS = float(os.getenv("STUB_LLM_JITTER_MS", "100"))
+TOKEN_MS = float(os.getenv("STUB_LLM_TOKEN_MS", "30"))
+
+app = FastAPI(title="Stub LLM")
+
+ANSWER = "The storms remember what men forget. Urithiru waits, silent, its towers sealed."
+
+# Lets a harness check that client disconnects reach the upstream request
+counters = {"streams_started": 0, "streams_completed": 0, "streams_cancelled": 0, "requests_disconnected": 0}
+
+
+def _delay():
+    return (DELAY_MS + random.uniform(-JITTER_MS, JITTER_MS)) / 1000
+
+
+def _tokens():
+    words = ANSWER.split(" ")
+    return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    try:
+        body = await request.json()
+    except ClientDisconnect:
+        # The caller gave up while sending the request, before any completion started
+        counters["requests_disconnected"] += 1
+        return Response(status_code=499)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    model = body.get("model", "stub")
+    if body.get("stream"):
+        return StreamingResponse(_stream(completion_id, model), media_type="text/event-stream")
+
+    await asyncio.sleep(_delay() + len(_tokens()) * TOKEN_MS / 1000)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": ANSWER},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 100, "completion_tokens": len(_tokens()), "total_tokens": 100 + len(_tokens())},
+    }
+
+
+async def _stream(completion_id, model):
+    counters["streams_started"] += 1
+
+    def chunk(delta, finish_reason=None):
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(data)}\n\n"
+
+    try:
+        await asyncio.sleep(_delay())
+        yield chunk({"role": "assistant", "content": ""})
+        for token in _tokens():
+            yield chunk({"content": token})
+            await asyncio.sleep(TOKEN_MS / 1000)
+        yield chunk({}, "stop")
+        yield "data: [DONE]\n\n"
+        counters["streams_completed"] += 1
+    except asyncio.CancelledError:
+        counters["streams_cancelled"] += 1
+        raise
+
+
+@app.get("/stats")
+async def stats():
+    return counters
@@ -0,0 +1,152 @@
+"""Crash-safety checks for the segment store: run with `python -m pytest` from RAG/."""
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from segment_store import MANIFEST, ReadOnlyStore, SegmentStore
+
+DIM = 8
+
+
+def vectors(n, seed=0):
+    return np.random.default_rng(seed).random((n, DIM), dtype=np.float32)
+
+
+def docs(start, n):
+    return [f"document {i}" for i in range(start, start + n)]
+
+
+def write_store(path, batches=3, size=4):
+    store = SegmentStore.open(path, index_meta={"type": "flat_ip", "dim": DIM, "params": {}})
+    for b in range(batches):
+        store.append(docs(b * size, size), vectors(size, seed=b))
+    return store
+
+
+def test_reopen_keeps_documents_and_vectors(tmp_path):
+    store = write_store(str(tmp_path))
+    store.close()
+
+    store = SegmentStore.open(str(tmp_path))
+    assert store.count == 12
+    assert [store.get(i) for i in range(12)] == docs(0, 12)
+    assert np.array_equal(np.concatenate(list(store.iter_vectors(start=4))), np.concatenate([vectors(4, 1), vectors(4, 2)]))
+    with pytest.raises(IndexError):
+        store.get(12)
+    store.close()
+
+
+def test_torn_manifest_record_is_dropped(tmp_path):
+    path = str(tmp_path)
+    write_store(path).close()
+    manifest = os.path.join(path, MANIFEST)
+    with open(manifest, "a", encoding="utf-8") as f:
+        # A crash half-way through appending the record of a fourth segment
+        f.write(json.dumps({"seq": 99, "op": "add", "segment": "seg-00000099", "first_id": 12, "count": 4})[:30])
+
+    store = SegmentStore.open(path)
+    assert store.count == 12
+    assert store.get(11) == "document 11"
+    # The torn line is gone, so the next record starts on a line of its own
+    store.append(docs(12, 2), vectors(2))
+    store.close()
+
+    store = SegmentStore.open(path)
+    assert store.count == 14
+    assert store.get(13) == "document 13"
+    store.close()
+
+
+def test_uncommitted_directories_are_removed_on_open(tmp_path):
+    path = str(tmp_path)
+    write_store(path).close()
+    segments = os.path.join(path, "segments")
+    # A segment written but never committed to MANIFEST, and a write that died before its rename
+    os.makedirs(os.path.join(segments, "seg-00000050"))
+    os.makedirs(os.path.join(segments, ".tmp-seg-00000051"))
+    os.makedirs(os.path.join(path, "snapshots", ".tmp-snap-00000052"))
+
+    store = SegmentStore.open(path)
+    assert sorted(os.listdir(segments)) == sorted(s.name for s in store.segments)
+    assert os.listdir(os.path.join(path, "snapshots")) == []
+    assert store.count == 12
+    store.close()
+
+
+def test_ids_survive_compaction(tmp_path):
+    path = str(tmp_path)
+    store = SegmentStore.open(path, index_meta={}, max_segments=2, merge_factor=2)
+    for b in range(6):
+        store.append(docs(b * 3, 3), vectors(3, seed=b))
+    store.maybe_compact()
+    store.close()  # waits for the background compaction
+
+    store = SegmentStore.open(path)
+    assert len(store.segments) <= 2
+    assert store.count == 18
+    assert [store.get(i) for i in range(18)] == docs(0, 18)
+    assert np.array_equal(np.concatenate(list(store.iter_vectors())), np.concatenate([vectors(3, b) for b in range(6)]))
+    # Replaced segments were deleted and later appends continue the ID sequence
+    assert len(os.listdir(os.path.join(path, "segments"))) == len(store.segments)
+    assert store.append(docs(18, 1), vectors(1)) == 18
+    store.close()
+
+
+def test_second_process_cannot_write(tmp_path):
+    path = str(tmp_path)
+    store = write_store(path)
+    child = (
+        "import sys\n"
+        "import numpy as np\n"
+        "from segment_store import ReadOnlyStore, SegmentStore\n"
+        "store = SegmentStore.open(sys.argv[1])\n"
+        "print(store.count)\n"
+        "try:\n"
+        "    store.append(['x'], np.zeros((1, 8), dtype='float32'))\n"
+        "except ReadOnlyStore:\n"
+        "    print('read-only')\n"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", child, path], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout.split()
+    assert out == ["12", "read-only"]
+
+    # Another store in this process is refused as well
+    other = SegmentStore.open(path)
+    with pytest.raises(ReadOnlyStore):
+        other.append(["x"], vectors(1))
+    other.close()
+    store.close()
+
+
+def test_legacy_documents_json_is_migrated(tmp_path):
+    pytest.importorskip("sentence_transformers")
+    import faiss
+    from rag_engine import RAGEngine
+
+    path = str(tmp_path)
+    documents = docs(0, 5)
+    index = faiss.IndexFlatL2(DIM)
+    index.add(vectors(5))
+    faiss.write_index(index, os.path.join(path, "index.faiss"))
+    with open(os.path.join(path, "documents.json"), "w") as f:
+        json.dump(documents, f)
+
+    rag = RAGEngine(max_batch=1)
+    rag.load(path)
+    assert rag.num_documents == 5
+    rag.save(path)
+    rag.close()
+
+    assert SegmentStore.exists(path)
+    rag = RAGEngine(max_batch=1)
+    rag.load(path)
+    assert rag.num_documents == 5
+    assert [rag.get_document(i) for i in range(5)] == documents
+    assert rag.index.ntotal == 5
+    rag.close()